@@ -3,35 +3,43 @@
 Find the three numbers in the given input file that sum to 2020. Print the
 numbers and their product.
 
-The input file's format is one number per line.
+The input file's format is one number per line. The target sum and the number
+of entries to combine can be changed with --target and --k.
 https://adventofcode.com/2020/day/1#part2
 """
 
-import argparse
+import argparse, math
+from ksum import find_first, find_sums, load_numbers, sorted_array
 
 def get_input(filename):
-  with open(filename, 'r') as f:
-    return sorted([int(x) for x in f.readlines()])
+  return sorted_array(load_numbers(filename))
 
-def find_pair(numbers):
-  for i in range(len(numbers)):
-    for j in range(len(numbers)):
-      if numbers[i] + numbers[j] >= 2020:
-        continue
-      for k in range(len(numbers)):
-        if j == i or j == k or k == i: continue
-        if numbers[i] + numbers[j] + numbers[k] == 2020:
-          return (numbers[i], numbers[j], numbers[k])
-  return None
+def find_pair(numbers, target=2020, k=3):
+  return find_first(numbers, target, k)
+
+def print_solution(solution):
+  print('Solution: %s' % ', '.join(['%d' % x for x in solution]))
+  print('Product: %d' % math.prod(solution))
 
 def main(args):
   numbers = get_input(args.filename)
-  solution = find_pair(numbers)
-  print('Solution: %d, %d, %d' % solution)
-  print('Product: %d' % (solution[0] * solution[1] * solution[2]))
+  if args.all:
+    solutions = list(find_sums(numbers, args.target, args.k))
+    for solution in solutions:
+      print_solution(solution)
+    print('%d solutions' % len(solutions))
+    return
+  solution = find_pair(numbers, args.target, args.k)
+  if solution is None:
+    print('No solution sums to %d' % args.target)
+    return
+  print_solution(solution)
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(__doc__)
   parser.add_argument('filename', help='Path to the input file')
+  parser.add_argument('--target', type=int, default=2020, help='Sum to search for')
+  parser.add_argument('--k', type=int, default=3, help='Number of entries to combine')
+  parser.add_argument('--all', action='store_true', help='List every solution instead of only the first')
   args = parser.parse_args()
-  main(args)
\ No newline at end of file
+  main(args)
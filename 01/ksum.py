@@ -0,0 +1,156 @@
+"""
+Shared k-sum engine for the day 1 solutions. Finds k entries of a list of
+numbers that sum to a target value.
+
+Entries are treated as a multiset: a value may appear in a solution as many
+times as it appears in the input, but no more. Solutions are reported as
+distinct combinations of values, so duplicated input values do not produce
+duplicated solutions.
+
+https://adventofcode.com/2020/day/1
+"""
+
+from array import array
+from itertools import islice
+from operator import and_, le
+
+READ_CHUNK_SIZE = 1 << 20
+# pairs are searched with a presence bytearray when the value range is at
+# most this many times the number of entries
+BITMAP_DENSITY = 4
+
+def load_numbers(filename):
+  """
+  Parse a file of whitespace-separated integers straight into a compact
+  array of 64-bit ints, reading it in fixed-size chunks.
+  """
+  numbers = array('q')
+  partial = b''
+  with open(filename, 'rb') as f:
+    chunk = f.read(READ_CHUNK_SIZE)
+    while chunk:
+      tokens = (partial + chunk).split()
+      # the last token may continue in the next chunk
+      partial = tokens.pop() if tokens and not chunk[-1:].isspace() else b''
+      numbers.extend(map(int, tokens))
+      chunk = f.read(READ_CHUNK_SIZE)
+  if partial:
+    numbers.append(int(partial))
+  return numbers
+
+def find_sums(numbers, target, k):
+  """
+  Generate every combination of k values from numbers that sums to target.
+  The numbers are sorted into a compact array once; pairs come from a
+  two-pointer sweep over it, and triples and above fix the smallest values
+  and finish with the same sweep.
+  """
+  if k < 1:
+    raise Exception('k must be at least 1, got %d' % k)
+  if k == 1:
+    if target in numbers:
+      yield (target,)
+    return
+  yield from _k_sums(sorted_array(numbers), 0, target, k)
+
+def find_first(numbers, target, k):
+  """
+  Find one combination of k values from numbers that sums to target. Return it
+  as a tuple, or None if there is no solution. For pairs, the values are
+  ordered as they appear in the input.
+  """
+  if k == 2:
+    return _first_pair(numbers, target)
+  return next(find_sums(numbers, target, k), None)
+
+def sorted_array(numbers):
+  """
+  Return numbers as a sorted array of 64-bit ints. An array that is already
+  sorted is returned as is, so callers can sort once and reuse it.
+  """
+  if isinstance(numbers, array) and numbers.typecode == 'q' and all(map(le, numbers, islice(numbers, 1, None))):
+    return numbers
+  return array('q', sorted(numbers))
+
+def _pair_values(numbers, target):
+  """
+  Return the set of values x that have another entry equal to target - x.
+
+  When the values are dense (their range is at most BITMAP_DENSITY times the
+  number of entries), presence is marked in a bytearray indexed by offset
+  from the minimum. Building it visits every entry in Python, but it is no
+  bigger than a small multiple of the array. Reversing it lines each value
+  up with its complement, so the values with a complement are found with a
+  C-level bytewise AND. Sparse values are sorted into an array instead and
+  the pairs found with the two-pointer sweep.
+  """
+  (lo, hi) = (min(numbers), max(numbers))
+  if hi - lo > BITMAP_DENSITY * len(numbers):
+    return {x for pair in _two_pointer(sorted_array(numbers), 0, target) for x in pair}
+
+  size = hi - lo + 1
+  present = bytearray(size)
+  for x in numbers:
+    present[x - lo] = 1
+  # offset o holds lo + o, whose complement is at offset (target - 2 * lo) - o
+  shift = target - 2 * lo - (size - 1)
+  mirrored = present[::-1]
+  if shift >= 0:
+    mirrored = (bytes(shift) + mirrored)[:size]
+  else:
+    mirrored = mirrored[-shift:] + bytes(min(-shift, size))
+  hits = bytes(map(and_, present, mirrored))
+
+  values = set()
+  offset = hits.find(1)
+  while offset != -1:
+    x = lo + offset
+    # a value that is its own complement needs two entries
+    if 2 * x != target or numbers.count(x) > 1:
+      values.add(x)
+    offset = hits.find(1, offset + 1)
+  return values
+
+def _first_pair(numbers, target):
+  if not numbers:
+    return None
+  values = _pair_values(numbers, target)
+  # the first entry (in input order) that has a complement starts the pair
+  x = next(filter(values.__contains__, numbers), None)
+  if x is None:
+    return None
+  return (x, target - x)
+
+def _two_pointer(numbers, lo, target):
+  hi = len(numbers) - 1
+  while lo < hi:
+    total = numbers[lo] + numbers[hi]
+    if total < target:
+      lo += 1
+    elif total > target:
+      hi -= 1
+    else:
+      (a, b) = (numbers[lo], numbers[hi])
+      yield (a, b)
+      # skip over duplicates so each combination of values is reported once
+      while lo < hi and numbers[lo] == a:
+        lo += 1
+      while lo < hi and numbers[hi] == b:
+        hi -= 1
+
+def _k_sums(numbers, start, target, k):
+  if k == 2:
+    yield from _two_pointer(numbers, start, target)
+    return
+  last = len(numbers) - k + 1
+  for i in range(start, last):
+    x = numbers[i]
+    if i > start and x == numbers[i - 1]:
+      continue
+    # numbers is sorted, so x is the smallest value left to pick
+    if x * k > target:
+      break
+    if x + numbers[-1] * (k - 1) < target:
+      continue
+    for rest in _k_sums(numbers, i + 1, target - x, k - 1):
+      yield (x, *rest)
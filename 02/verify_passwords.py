@@ -12,7 +12,12 @@ the selected password policy (see below).
 https://adventofcode.com/2020/day/2
 """
 
-import argparse
+import argparse, re
+from array import array
+from collections import Counter, namedtuple
+
+PASSWORD_LINE = re.compile(rb'^(\d+)-(\d+) (.): (.*?)[ \t\r]*$', re.M)
+BLANK_LINE = re.compile(rb'[ \t\r]*$', re.M)
 
 class UserSelectableMeta(type):
   def __str__(self):
@@ -26,6 +31,15 @@ class DefaultPasswordPolicy(metaclass=UserSelectableMeta):
   def validate(entry):
     return True
 
+  @classmethod
+  def validate_many(cls, columns):
+    """
+    Validate every entry of a PasswordColumns at once, returning an iterable
+    of bools. Subclasses override this with a version that works on the
+    columns directly instead of building an entry per password.
+    """
+    return map(cls.validate, columns.entries())
+
   @classmethod
   def match_string(cls, policy_name):
     for subcls in cls.get_choices():
@@ -51,6 +65,12 @@ class RangePasswordPolicy(DefaultPasswordPolicy):
     # in this policy, "x" and "y" are range of number of occurrences of the character
     return entry.password.count(entry.char) in range(entry.policy_x, entry.policy_y + 1)
 
+  @staticmethod
+  def validate_many(columns):
+    count = columns.buffer.count
+    return map(lambda char, start, end, lo, hi: lo <= count(char, start, end) <= hi,
+      columns.chars, columns.starts, columns.ends, columns.policy_x, columns.policy_y)
+
 class PositionsPasswordPolicy(DefaultPasswordPolicy):
   """
   Match passwords where, of the specified 1-based positions in the string,
@@ -61,6 +81,15 @@ class PositionsPasswordPolicy(DefaultPasswordPolicy):
     # in this policy, "x" and "y" are positions in the string
     return [c == entry.char for c in [entry.password[entry.policy_x - 1], entry.password[entry.policy_y - 1]]].count(True) == 1
 
+  @staticmethod
+  def validate_many(columns):
+    buf = columns.buffer
+    def check(char, start, end, x, y):
+      if not (0 < x <= end - start and 0 < y <= end - start):
+        raise Exception('Position out of range for password %r' % buf[start:end].decode())
+      return (buf[start + x - 1] == char) != (buf[start + y - 1] == char)
+    return map(check, columns.chars, columns.starts, columns.ends, columns.policy_x, columns.policy_y)
+
 class PasswordListEntry:
   def __init__(self, line):
     (policy, self.password) = line.split(': ')
@@ -81,11 +110,116 @@ class PasswordList:
   def count_valid(self):
     return [self.policy_cls.validate(entry) for entry in self._passwords].count(True)
 
+class PasswordPolicyReport:
+  """
+  Check every line of a password file against several policies in one
+  streaming pass. Entries are parsed, checked, and discarded; only the
+  counts are kept.
+  """
+  def __init__(self, filename, policies=None):
+    if policies is None:
+      policies = DefaultPasswordPolicy.get_choices()
+    self.filename = filename
+    self.policies = policies
+    self.total = 0
+    self.counts = {policy: 0 for policy in policies}
+    # maps the tuple of policies an entry was valid under to the number of such entries
+    self.joint = Counter()
+
+    with open(filename, 'r') as f:
+      for line in f:
+        if not line.strip():
+          continue
+        entry = PasswordListEntry(line)
+        valid_under = tuple([policy for policy in policies if policy.validate(entry)])
+        for policy in valid_under:
+          self.counts[policy] += 1
+        self.joint[valid_under] += 1
+        self.total += 1
+
+  def print_counts(self):
+    for policy in self.policies:
+      print('%d valid passwords (%s)' % (self.counts[policy], policy))
+
+  def print_joint(self):
+    print('Joint breakdown of %d passwords:' % self.total)
+    for (valid_under, count) in self.joint.most_common():
+      names = ', '.join([str(policy) for policy in valid_under]) or '(none)'
+      print('  %d valid under exactly: %s' % (count, names))
+
+ColumnEntry = namedtuple('ColumnEntry', ['policy_x', 'policy_y', 'char', 'password'])
+
+class PasswordColumns:
+  """
+  Column-oriented form of a password list. The policy numbers and characters
+  are kept in parallel arrays, and each password is a [start, end) slice of
+  one shared buffer holding the raw file contents. Offsets into the buffer
+  are byte offsets, so only ASCII files are accepted.
+  """
+  def __init__(self, filename):
+    with open(filename, 'rb') as f:
+      self.buffer = f.read()
+
+    self.policy_x = array('l')
+    self.policy_y = array('l')
+    self.chars = bytearray()
+    self.starts = array('L')
+    self.ends = array('L')
+
+    if not self.buffer.isascii():
+      raise Exception('Columnar parsing only supports ASCII password files')
+
+    # walk the buffer in place, one line at a time; the password is only
+    # recorded as offsets
+    (pos, size) = (0, len(self.buffer))
+    while pos < size:
+      match = PASSWORD_LINE.match(self.buffer, pos)
+      if match is not None:
+        self.policy_x.append(int(match.group(1)))
+        self.policy_y.append(int(match.group(2)))
+        self.chars.append(self.buffer[match.start(3)])
+        self.starts.append(match.start(4))
+        self.ends.append(match.end(4))
+      else:
+        match = BLANK_LINE.match(self.buffer, pos)
+        if match is None:
+          end = self.buffer.find(b'\n', pos)
+          raise Exception('Malformed password line: %r' % self.buffer[pos:size if end == -1 else end].decode())
+      # the match ends at the newline or the end of the buffer
+      pos = match.end() + 1
+
+  def __len__(self):
+    return len(self.chars)
+
+  def entries(self):
+    for (x, y, char, start, end) in zip(self.policy_x, self.policy_y, self.chars, self.starts, self.ends):
+      yield ColumnEntry(x, y, chr(char), self.buffer[start:end].decode())
+
+class ColumnarPasswordList:
+  def __init__(self, filename, policy_cls=DefaultPasswordPolicy):
+    self.columns = PasswordColumns(filename)
+
+    self.filename = filename
+    self.policy_cls = policy_cls
+
+  def count_valid(self):
+    return sum(self.policy_cls.validate_many(self.columns))
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description=__doc__, epilog=DefaultPasswordPolicy.get_choice_descriptions(), formatter_class=argparse.RawTextHelpFormatter)
   parser.add_argument('filename', help='Path to the input file to process')
   parser.add_argument('--policy', '-p', dest='policy_cls', default=DefaultPasswordPolicy, choices=DefaultPasswordPolicy.get_choices(), type=DefaultPasswordPolicy.match_string)
+  parser.add_argument('--columnar', action='store_true', help='Parse the file into columns and validate them in bulk')
+  parser.add_argument('--all-policies', action='store_true', help='Check every policy in a single pass over the file (ignores --policy)')
+  parser.add_argument('--joint', action='store_true', help='With --all-policies, also print how many passwords are valid under each combination of policies')
   args = parser.parse_args()
 
-  password_list = PasswordList(args.filename, args.policy_cls)
-  print('%d valid passwords' % password_list.count_valid())
\ No newline at end of file
+  if args.all_policies:
+    report = PasswordPolicyReport(args.filename)
+    report.print_counts()
+    if args.joint:
+      report.print_joint()
+  else:
+    list_cls = ColumnarPasswordList if args.columnar else PasswordList
+    password_list = list_cls(args.filename, args.policy_cls)
+    print('%d valid passwords' % password_list.count_valid())
\ No newline at end of file
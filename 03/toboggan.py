@@ -6,43 +6,109 @@ toboggan will hit on its way down the hill for several possible slopes.
 https://adventofcode.com/2020/day/3
 """
 
-import argparse
+import argparse, mmap
 
 class Terrain:
   OPEN = '.'
   TREE = '#'
 
   def __init__(self, filename):
-    with open(filename, 'r') as f:
-      self._lines = f.readlines()
+    with open(filename, 'rb') as f:
+      data = f.read()
 
-    self.height = len(self._lines)
-    self.width = len(self._lines[0])
+    newline = data.find(b'\n')
+    # the rows are kept back to back in one buffer, so (x, y) is at y * width + x
+    self._grid = data.translate(None, b'\r\n')
+    self.width = len(data.rstrip(b'\r\n')) if newline == -1 else len(data[:newline].rstrip(b'\r'))
+    self.height = len(self._grid) // self.width if self.width else 0
 
   def read_coords(self, x, y):
-    x = x % (self.width - 1)
+    x = x % self.width
     if y >= self.height:
       raise Exception('y %d out of bounds %d' % (y, self.height))
 
-    return self._lines[y][x]
+    return chr(self._grid[y * self.width + x])
 
   def count_hits(self, slope_x=3, slope_y=1):
-    (x, y) = (0, 0)
-    trees = 0
-    while y < self.height:
-      obj = self.read_coords(x, y)
-      if obj == Terrain.TREE:
-        trees += 1
-      (x, y) = (x + slope_x, y + slope_y)
+    return self.count_hits_many([(slope_x, slope_y)])[0]
 
-    return trees
+  def count_hits_many(self, slopes):
+    """
+    Count the trees hit for each of the given (slope_x, slope_y) slopes.
+    Return the hit counts in the same order as slopes.
+
+    Step k of a slope lands on column k * slope_x % width, which only depends
+    on k % width. The steps sharing a residue r are therefore evenly spaced
+    in the buffer, and one strided slice starting at step r holds all of
+    them, so each slope takes width slice counts and no per-row work.
+    """
+    (grid, width, height) = (self._grid, self.width, self.height)
+    if not height:
+      return [0] * len(slopes)
+    hits = []
+    for (slope_x, slope_y) in slopes:
+      row_stride = slope_y * width
+      period = width * row_stride
+      hits.append(sum([
+        grid[r * row_stride + r * slope_x % width::period].count(b'#')
+        for r in range(min(width, (height - 1) // slope_y + 1))
+      ]))
+
+    return hits
+
+class StreamingTerrain:
+  """
+  Count tree hits directly from a memory-mapped terrain file. Every row has
+  the same length, so a cell is found by arithmetic on the fixed row stride
+  and nothing is copied into Python objects. The rows are scanned once,
+  front to back, for all slopes at the same time.
+  """
+  TREE = ord(Terrain.TREE)
+
+  def __init__(self, filename):
+    self.filename = filename
+
+  def count_hits_many(self, slopes):
+    with open(self.filename, 'rb') as f:
+      if f.seek(0, 2) == 0:
+        return [0] * len(slopes)
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mm, 'madvise'):
+          mm.madvise(mmap.MADV_SEQUENTIAL)
+        return self._scan(mm, slopes)
+
+  def _scan(self, mm, slopes):
+    size = len(mm)
+    newline = mm.find(b'\n')
+    if newline == -1:
+      (width, stride) = (size, size)
+    else:
+      stride = newline + 1
+      width = newline - 1 if newline > 0 and mm[newline - 1] == ord('\r') else newline
+    # the last row may or may not be followed by a line terminator
+    height = (size + stride - width) // stride
+
+    tree = StreamingTerrain.TREE
+    hits = [0] * len(slopes)
+    cursors = [0] * len(slopes)
+    for y in range(height):
+      offset = y * stride
+      for (i, (slope_x, slope_y)) in enumerate(slopes):
+        if y % slope_y:
+          continue
+        if mm[offset + cursors[i]] == tree:
+          hits[i] += 1
+        cursors[i] = (cursors[i] + slope_x) % width
+
+    return hits
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument('filename', help='Path to the input file')
+  parser.add_argument('--stream', action='store_true', help='Scan a memory-mapped copy of the file instead of loading it')
   args = parser.parse_args()
 
-  terrain = Terrain(args.filename)
+  terrain = StreamingTerrain(args.filename) if args.stream else Terrain(args.filename)
   slopes = [
     (1, 1),
     (3, 1),
@@ -51,9 +117,8 @@ if __name__ == '__main__':
     (1, 2)
   ]
   product = 1
-  for slope in slopes:
-    hits = terrain.count_hits(*slope)
+  for (slope, hits) in zip(slopes, terrain.count_hits_many(slopes)):
     print('(%d, %d) hits: %d' % (*slope, hits))
     product *= hits
 
-  print('Product: %d' % product)
\ No newline at end of file
+  print('Product: %d' % product)
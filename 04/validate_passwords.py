@@ -7,12 +7,99 @@ each field's value against additional, stricter rules.
 https://adventofcode.com/2020/day/4
 """
 
-import argparse, re
+import argparse, re, time
+from concurrent.futures import ProcessPoolExecutor
 
-YEAR_PATTERN = re.compile(r'^\d{4}$')
 HCL_PATTERN = re.compile(r'^#[0-9a-f]{6}$')
-EYE_COLORS = ['amb', 'blu', 'brn', 'gry', 'grn', 'hzl', 'oth']
-PID_PATTERN = re.compile(r'^\d{9}$')
+EYE_COLORS = frozenset(['amb', 'blu', 'brn', 'gry', 'grn', 'hzl', 'oth'])
+
+def is_number(s):
+  return s.isdigit() and s.isascii()
+
+def year_between(lo, hi):
+  return lambda year: len(year) == 4 and is_number(year) and lo <= int(year) <= hi
+
+def height_between(cm_lo, cm_hi, in_lo, in_hi):
+  def check(hgt):
+    (number, unit) = (hgt[:-2], hgt[-2:])
+    if not is_number(number):
+      return False
+    if unit == 'cm':
+      return cm_lo <= int(number) <= cm_hi
+    if unit == 'in':
+      return in_lo <= int(number) <= in_hi
+    return False
+  return check
+
+def compile_rules(rules):
+  """
+  Flatten a rules dict into a tuple of (key, checker) pairs, which is cheaper
+  to walk than the dict for every record.
+  """
+  return tuple(rules.items())
+
+def fields_valid(fields, compiled_rules):
+  """
+  Check a dict of record fields against compiled rules, stopping at the first
+  missing field or failed check.
+  """
+  for (key, check) in compiled_rules:
+    value = fields.get(key)
+    if value is None or not check(value):
+      return False
+  return True
+
+class RuleStats:
+  """
+  Per-rule outcome counters and cumulative check time, collected by passing
+  an instance as the stats argument of the validation methods. Every rule is
+  run and counted for every record, even after an earlier rule has rejected
+  it, so the counts do not depend on the order of the rules.
+  """
+  def __init__(self):
+    self.missing = {}
+    self.failed = {}
+    self.passed = {}
+    self.seconds = {}
+    # rule keys in the order they were run, used to order the report
+    self.order = {}
+
+  def fields_valid(self, fields, compiled_rules):
+    """
+    Instrumented version of fields_valid. Returns the same verdict.
+    """
+    valid = True
+    for (key, check) in compiled_rules:
+      if key not in self.order:
+        self.order[key] = None
+      value = fields.get(key)
+      if value is None:
+        self.missing[key] = self.missing.get(key, 0) + 1
+        valid = False
+        continue
+      start = time.perf_counter()
+      ok = check(value)
+      self.seconds[key] = self.seconds.get(key, 0.0) + time.perf_counter() - start
+      if ok:
+        self.passed[key] = self.passed.get(key, 0) + 1
+      else:
+        self.failed[key] = self.failed.get(key, 0) + 1
+        valid = False
+    return valid
+
+  def merge(self, other):
+    for (mine, theirs) in [(self.missing, other.missing), (self.failed, other.failed), (self.passed, other.passed), (self.seconds, other.seconds)]:
+      for (key, value) in theirs.items():
+        mine[key] = mine.get(key, 0) + value
+    self.order.update(other.order)
+
+  def keys(self):
+    return list(self.order)
+
+  def print_report(self):
+    print('%-5s %10s %10s %10s %12s' % ('field', 'missing', 'failed', 'passed', 'time (ms)'))
+    for key in self.keys():
+      print('%-5s %10d %10d %10d %12.3f' % (key, self.missing.get(key, 0), self.failed.get(key, 0), self.passed.get(key, 0), self.seconds.get(key, 0.0) * 1000))
 
 class PasswordRecord:
   DEFAULT_VALIDATION_RULES = {
@@ -26,14 +113,13 @@ class PasswordRecord:
   }
 
   STRICT_VALIDATION_RULES = {
-    'byr': lambda byr: YEAR_PATTERN.match(byr) is not None and int(byr) in range(1920, 2002 + 1),
-    'iyr': lambda iyr: YEAR_PATTERN.match(iyr) is not None and int(iyr) in range(2010, 2020 + 1),
-    'eyr': lambda eyr: YEAR_PATTERN.match(eyr) is not None and int(eyr) in range(2020, 2030 + 1),
-    'hgt': lambda hgt: ('cm' in hgt and int(hgt.replace('cm', '')) in range(150, 193 + 1)) \
-      or ('in' in hgt and int(hgt.replace('in', '')) in range(59, 76 + 1)),
-    'hcl': lambda hcl: HCL_PATTERN.match(hcl) is not None,
-    'ecl': lambda ecl: ecl in EYE_COLORS,
-    'pid': lambda pid: PID_PATTERN.match(pid) is not None
+    'byr': year_between(1920, 2002),
+    'iyr': year_between(2010, 2020),
+    'eyr': year_between(2020, 2030),
+    'hgt': height_between(150, 193, 59, 76),
+    'hcl': lambda hcl, match=HCL_PATTERN.match: match(hcl) is not None,
+    'ecl': EYE_COLORS.__contains__,
+    'pid': lambda pid: len(pid) == 9 and is_number(pid)
   }
 
   def __init__(self, data=None):
@@ -53,10 +139,14 @@ class PasswordRecord:
   def has_field(self, key):
     return key in self._fields
 
-  def is_valid(self, rules=None):
+  def is_valid(self, rules=None, stats=None):
     if rules is None:
       rules = PasswordRecord.DEFAULT_VALIDATION_RULES
-    return all([self.has_field(key) and rules[key](self.get_field(key)) for key in rules])
+    check = fields_valid if stats is None else stats.fields_valid
+    return self.is_valid_compiled(compile_rules(rules), check)
+
+  def is_valid_compiled(self, compiled_rules, check=fields_valid):
+    return check(self._fields, compiled_rules)
 
   def is_empty(self):
     return len(self._fields) == 0
@@ -66,30 +156,124 @@ class PassportRecordsList:
     with open(filename, 'r') as f:
       self._records = self.read_file(f)
 
-  def read_file(self, f):
-    records = []
+  @staticmethod
+  def iter_records(lines):
+    """
+    Generate records from an iterable of lines, yielding each one as soon as
+    the blank line (or end of input) that closes it is read.
+    """
     record = PasswordRecord()
-    for line in f:
-      if line == '\n':
-        records.append(record)
-        record = PasswordRecord()
+    for line in lines:
+      line = line.strip()
+      if not line:
+        if not record.is_empty():
+          yield record
+          record = PasswordRecord()
         continue
-      record.add_data(line.replace('\n', ''))
+      record.add_data(line)
 
     if not record.is_empty():
-      records.append(record)
+      yield record
+
+  def read_file(self, f):
+    return list(self.iter_records(f))
+
+  def count_valid(self, rules=None, stats=None):
+    if rules is None:
+      rules = PasswordRecord.DEFAULT_VALIDATION_RULES
+    return count_valid_records(self._records, rules, stats)
+
+  @staticmethod
+  def count_valid_streaming(filename, rules=None, stats=None):
+    """
+    Count the valid records of a file without keeping them. Each record is
+    validated and dropped as soon as it has been read.
+    """
+    if rules is None:
+      rules = PasswordRecord.DEFAULT_VALIDATION_RULES
+    with open(filename, 'r') as f:
+      return count_valid_records(PassportRecordsList.iter_records(f), rules, stats)
+
+  @staticmethod
+  def count_valid_parallel(filename, strict=False, jobs=1, stats=None):
+    """
+    Split the file into byte ranges that start and end on record boundaries
+    and count the valid records of each range in a separate process. The
+    rules are chosen by name (strict or not) because the rule lambdas cannot
+    be sent to a worker process. Each worker collects its own stats, which
+    are merged into stats.
+    """
+    shards = [(filename, start, end, strict, stats is not None) for (start, end) in find_shards(filename, jobs)]
+    valid = 0
+    with ProcessPoolExecutor(max_workers=min(jobs, len(shards))) as executor:
+      for (count, shard_stats) in executor.map(count_valid_shard, shards):
+        valid += count
+        if stats is not None:
+          stats.merge(shard_stats)
+    return valid
+
+def count_valid_records(records, rules, stats=None):
+  compiled_rules = compile_rules(rules)
+  # pick the validator once so that disabled stats cost nothing per record
+  check = fields_valid if stats is None else stats.fields_valid
+  return sum(record.is_valid_compiled(compiled_rules, check) for record in records)
+
+def find_shards(filename, count):
+  """
+  Return up to count (start, end) byte ranges covering the file. Each range
+  starts just after a blank line (or at the start of the file), so no record
+  is split between two ranges.
+  """
+  with open(filename, 'rb') as f:
+    size = f.seek(0, 2)
+    offsets = [0]
+    for i in range(1, count):
+      pos = size * i // count
+      if pos <= offsets[-1]:
+        continue
+      f.seek(pos)
+      f.readline() # skip the rest of the line we landed in
+      line = f.readline()
+      while line and line.strip():
+        line = f.readline()
+      if f.tell() >= size:
+        break
+      offsets.append(f.tell())
+  offsets.append(size)
+  return list(zip(offsets[:-1], offsets[1:]))
 
-    return records
+def read_shard_lines(filename, start, end):
+  with open(filename, 'rb') as f:
+    f.seek(start)
+    pos = start
+    while pos < end:
+      line = f.readline()
+      if not line:
+        break
+      pos += len(line)
+      yield line.decode()
 
-  def count_valid(self, rules=None):
-    return [record.is_valid(rules) for record in self._records].count(True)
+def count_valid_shard(shard):
+  (filename, start, end, strict, collect_stats) = shard
+  rules = PasswordRecord.STRICT_VALIDATION_RULES if strict else PasswordRecord.DEFAULT_VALIDATION_RULES
+  stats = RuleStats() if collect_stats else None
+  records = PassportRecordsList.iter_records(read_shard_lines(filename, start, end))
+  return (count_valid_records(records, rules, stats), stats)
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument('filename', help='Path to the input file to validate')
   parser.add_argument('--strict', action='store_true', help='Use "strict" validation rules')
+  parser.add_argument('--jobs', '-j', type=int, default=1, help='Validate the file in this many parallel processes')
+  parser.add_argument('--stats', action='store_true', help='Print per-rule outcome counts and timings')
   args = parser.parse_args()
 
-  rules = PasswordRecord.STRICT_VALIDATION_RULES if args.strict else PasswordRecord.DEFAULT_VALIDATION_RULES
-  records = PassportRecordsList(args.filename)
-  print('Valid records: %d' % records.count_valid(rules))
\ No newline at end of file
+  stats = RuleStats() if args.stats else None
+  if args.jobs > 1:
+    valid = PassportRecordsList.count_valid_parallel(args.filename, args.strict, args.jobs, stats)
+  else:
+    rules = PasswordRecord.STRICT_VALIDATION_RULES if args.strict else PasswordRecord.DEFAULT_VALIDATION_RULES
+    valid = PassportRecordsList.count_valid_streaming(args.filename, rules, stats)
+  print('Valid records: %d' % valid)
+  if stats is not None:
+    stats.print_report()
\ No newline at end of file
@@ -9,6 +9,27 @@ https://adventofcode.com/2020/day/5
 import argparse
 
 SEAT_TO_INT = str.maketrans('BRFL', '1100')
+SEAT_COUNT = 1 << 10
+ROWS = 128
+COLUMNS = 8
+FULL_ROW = (1 << COLUMNS) - 1
+
+def longest_run(mask):
+  """
+  Return (start, length) of the longest run of set bits in a row mask.
+  """
+  (best_start, best_len, start) = (0, 0, None)
+  for col in range(COLUMNS + 1):
+    if col < COLUMNS and mask >> col & 1:
+      if start is None:
+        start = col
+    elif start is not None:
+      if col - start > best_len:
+        (best_start, best_len) = (start, col - start)
+      start = None
+  return (best_start, best_len)
+
+LONGEST_RUNS = [longest_run(mask) for mask in range(FULL_ROW + 1)]
 
 def parse_seats(filename):
   with open(filename, 'r') as f:
@@ -19,12 +40,132 @@ def find_seat(seats):
     if seats[i] - seats[i-1] > 1:
       return seats[i] - 1
 
+def parse_seat_map(filename):
+  """
+  Decode the boarding passes into a map of the seat id space, with a 1 byte
+  at every taken seat id. No sorting is needed to query it.
+  """
+  seat_map = bytearray(SEAT_COUNT)
+  with open(filename, 'r') as f:
+    for line in f:
+      line = line.strip()
+      if line:
+        seat_map[int(line.translate(SEAT_TO_INT), 2)] = 1
+  return seat_map
+
+def find_max_seat(seat_map):
+  return seat_map.rfind(1)
+
+def find_seat_in_map(seat_map):
+  """
+  Find the free seat whose neighbors on both sides are taken.
+  """
+  gap = seat_map.find(b'\x01\x00\x01')
+  if gap == -1:
+    return None
+  return gap + 1
+
+class SeatIndex:
+  """
+  Occupancy index over the plane's seats, kept as one bit mask per row (bit
+  c of row r is set when seat r * 8 + c is taken). Passes can be added and
+  removed as they are scanned, and free seats can be queried without
+  re-reading the manifest.
+  """
+  def __init__(self, seats=()):
+    self._rows = [0] * ROWS
+    self.taken = 0
+    for seat in seats:
+      self.add(seat)
+
+  @classmethod
+  def from_seat_map(cls, seat_map):
+    """
+    Build an index from a map made by parse_seat_map.
+    """
+    return cls(seat for (seat, taken) in enumerate(seat_map) if taken)
+
+  @staticmethod
+  def _locate(seat):
+    if not 0 <= seat < SEAT_COUNT:
+      raise Exception('Seat id %d out of range' % seat)
+    return divmod(seat, COLUMNS)
+
+  def add(self, seat):
+    (row, col) = self._locate(seat)
+    if self._rows[row] >> col & 1:
+      raise Exception('Seat %d is already taken' % seat)
+    self._rows[row] |= 1 << col
+    self.taken += 1
+
+  def remove(self, seat):
+    (row, col) = self._locate(seat)
+    if not self._rows[row] >> col & 1:
+      raise Exception('Seat %d is not taken' % seat)
+    self._rows[row] &= ~(1 << col)
+    self.taken -= 1
+
+  def is_taken(self, seat):
+    (row, col) = self._locate(seat)
+    return self._rows[row] >> col & 1 == 1
+
+  def free_seats(self, first_row=0, last_row=ROWS - 1):
+    """
+    List the free seat ids in rows first_row through last_row (inclusive).
+    """
+    seats = []
+    for row in range(first_row, last_row + 1):
+      free = ~self._rows[row] & FULL_ROW
+      while free:
+        low_bit = free & -free
+        seats.append(row * COLUMNS + low_bit.bit_length() - 1)
+        free ^= low_bit
+    return seats
+
+  def largest_free_block(self):
+    """
+    Find the longest run of free seats within a single row. Return the first
+    seat id of the run and its length; the lowest seat id wins ties.
+    """
+    (best_seat, best_len) = (None, 0)
+    for (row, mask) in enumerate(self._rows):
+      (start, length) = LONGEST_RUNS[~mask & FULL_ROW]
+      if length > best_len:
+        (best_seat, best_len) = (row * COLUMNS + start, length)
+        if length == COLUMNS:
+          break
+    return (best_seat, best_len)
+
+  def adjacent_free_pairs(self, first_row=0, last_row=ROWS - 1):
+    """
+    List (seat, seat + 1) pairs of free seats that sit side by side in the
+    same row, for rows first_row through last_row (inclusive).
+    """
+    pairs = []
+    for row in range(first_row, last_row + 1):
+      free = ~self._rows[row] & FULL_ROW
+      # bit c is set when both column c and column c + 1 are free
+      starts = free & (free >> 1)
+      while starts:
+        low_bit = starts & -starts
+        seat = row * COLUMNS + low_bit.bit_length() - 1
+        pairs.append((seat, seat + 1))
+        starts ^= low_bit
+    return pairs
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument('filename', help='Path to the file to process')
+  parser.add_argument('--occupancy', action='store_true', help='Also report free seats, the largest free block, and adjacent free pairs')
   args = parser.parse_args()
 
-  seats = parse_seats(args.filename)
-  max_id = seats[-1]
-  print('Max seat id: %d' % max_id)
-  print('Our seat: %d' % find_seat(seats))
\ No newline at end of file
+  seat_map = parse_seat_map(args.filename)
+  print('Max seat id: %d' % find_max_seat(seat_map))
+  print('Our seat: %d' % find_seat_in_map(seat_map))
+
+  if args.occupancy:
+    index = SeatIndex.from_seat_map(seat_map)
+    (block_seat, block_len) = index.largest_free_block()
+    print('Free seats: %d' % len(index.free_seats()))
+    print('Largest free block: %d seats starting at %s' % (block_len, block_seat))
+    print('Adjacent free pairs: %d' % len(index.adjacent_free_pairs()))
\ No newline at end of file
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 """
 Process rules specifying what types of bags may be contained by other bags.
-Two modes are supported.
+Three modes are supported.
 
 ancestor mode: determine the number of types of bags that may contain a shiny
 gold bag.
 
 children mode: determine the number of bags required inside one shiny gold bag.
 
+batch mode: compute both numbers for every bag type and write them out as CSV
+or JSON.
+
 Each line of the file is a rule. Each rule maps a bag type to a list of other
 bag types prefixed by quantities. I was going to actually write out a grammar
 for it here, but... nah.
@@ -15,7 +18,9 @@ for it here, but... nah.
 https://adventofcode.com/2020/day/7
 """
 
-import argparse, re
+import argparse, csv, hashlib, json, os, re, sys
+from array import array
+from collections import deque
 
 BAG_PATTERN = re.compile(r'bags?')
 
@@ -45,40 +50,306 @@ class LuggageRule:
     self.ruleset.index[self.type] = self
 
   def can_contain(self, target_type):
-    return any([
-      contents['bag_type'] == target_type
-      or (contents['bag_type'] in self.ruleset.index
-        and self.ruleset.index[contents['bag_type']].can_contain(target_type)
-      )
-      for contents in self.contents_list])
+    return self.type in self.ruleset.find_ancestors(target_type)
+
+class RuleGraph:
+  """
+  Compact, integer-indexed form of a rule set. Every bag type is interned to
+  an id (its position in names). The contents of bag i are edges
+  edge_start[i] to edge_start[i + 1] of the parallel edge_bag and edge_qty
+  arrays. has_rule[i] is 0 for bags that are mentioned but have no rule.
+  """
+  CACHE_VERSION = 2
+
+  def __init__(self, names, has_rule, edge_start, edge_bag, edge_qty):
+    self.names = names
+    self.ids = {name: i for (i, name) in enumerate(names)}
+    self.has_rule = has_rule
+    self.edge_start = edge_start
+    self.edge_bag = edge_bag
+    self.edge_qty = edge_qty
+    self._parent_start = None
+    self._parent_bag = None
+
+  def __len__(self):
+    return len(self.names)
+
+  @staticmethod
+  def from_rules(rules):
+    names = [rule.type for rule in rules]
+    ids = {name: i for (i, name) in enumerate(names)}
+    (edge_start, edge_bag, edge_qty) = (array('L', [0]), array('L'), array('L'))
+    for rule in rules:
+      for contents in rule.contents_list:
+        if contents['bag_type'] not in ids:
+          ids[contents['bag_type']] = len(names)
+          names.append(contents['bag_type'])
+        edge_bag.append(ids[contents['bag_type']])
+        edge_qty.append(contents['qty'])
+      edge_start.append(len(edge_bag))
+    has_rule = bytearray([1]) * len(rules) + bytearray(len(names) - len(rules))
+    # bags without a rule have no contents
+    edge_start.extend([len(edge_bag)] * (len(names) - len(rules)))
+    return RuleGraph(names, has_rule, edge_start, edge_bag, edge_qty)
+
+  @staticmethod
+  def cache_path(filename, cache_dir):
+    with open(filename, 'rb') as f:
+      digest = hashlib.sha256(f.read()).hexdigest()
+    return os.path.join(cache_dir, 'luggage-%s.cache' % digest)
+
+  @staticmethod
+  def load(path):
+    """
+    Load a graph saved with save(). The file is a JSON header line with the
+    version, the bag names and the array lengths, followed by the raw array
+    data. Return None if there is no usable cache file at path; a cache file
+    that cannot be read or does not describe a valid graph is ignored.
+    """
+    try:
+      with open(path, 'rb') as f:
+        header = json.loads(f.readline())
+        if header['version'] != RuleGraph.CACHE_VERSION or header['itemsize'] != array('L').itemsize:
+          return None
+        names = header['names']
+        has_rule = bytearray(f.read(len(names)))
+        arrays = []
+        for length in (len(names) + 1, header['edges'], header['edges']):
+          values = array('L')
+          values.fromfile(f, length)
+          arrays.append(values)
+        if f.read(1):
+          return None
+    except Exception:
+      return None
+    (edge_start, edge_bag, edge_qty) = arrays
+    if (
+      not all(isinstance(name, str) for name in names)
+      or len(has_rule) != len(names)
+      or edge_start[0] != 0 or edge_start[-1] != len(edge_bag)
+      or any(edge_start[i] > edge_start[i + 1] for i in range(len(names)))
+      or any(bag >= len(names) for bag in edge_bag)
+    ):
+      return None
+    return RuleGraph(names, has_rule, edge_start, edge_bag, edge_qty)
+
+  def save(self, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    header = {
+      'version': RuleGraph.CACHE_VERSION,
+      'itemsize': self.edge_start.itemsize,
+      'names': self.names,
+      'edges': len(self.edge_bag)
+    }
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+      f.write(json.dumps(header).encode() + b'\n')
+      f.write(self.has_rule)
+      for values in (self.edge_start, self.edge_bag, self.edge_qty):
+        values.tofile(f)
+    os.replace(tmp_path, path)
+
+  def children(self, bag):
+    return range(self.edge_start[bag], self.edge_start[bag + 1])
+
+  def parents(self, bag):
+    """
+    Return the ids of the bags that directly contain bag. The reverse edge
+    arrays are built the first time this is called.
+    """
+    if self._parent_start is None:
+      counts = [0] * (len(self) + 1)
+      for child in self.edge_bag:
+        counts[child + 1] += 1
+      for i in range(len(self)):
+        counts[i + 1] += counts[i]
+      parent_bag = array('L', bytes(self.edge_bag.itemsize * len(self.edge_bag)))
+      fill = counts[:]
+      for parent in range(len(self)):
+        for edge in self.children(parent):
+          child = self.edge_bag[edge]
+          parent_bag[fill[child]] = parent
+          fill[child] += 1
+      (self._parent_start, self._parent_bag) = (counts, parent_bag)
+    return self._parent_bag[self._parent_start[bag]:self._parent_start[bag + 1]]
 
 class LuggageRules:
-  def __init__(self, filename):
-    self.index = {}
-    with open(filename, 'r') as f:
-      self.rules = [LuggageRule(line, self) for line in f.readlines()]
+  def __init__(self, filename, cache_dir=None):
+    """
+    Load the rules in filename. If cache_dir is given, the compiled rule
+    graph is cached there, keyed by a hash of the file's contents, and later
+    loads of the same contents skip parsing. The LuggageRule objects (rules
+    and index) are only parsed when they are first accessed.
+    """
+    self.filename = filename
+    self._rules = None
+    self._index = None
+
+    self.graph = None
+    if cache_dir is not None:
+      cache_path = RuleGraph.cache_path(filename, cache_dir)
+      self.graph = RuleGraph.load(cache_path)
+    if self.graph is None:
+      self.graph = RuleGraph.from_rules(self.rules)
+      if cache_dir is not None:
+        self.graph.save(cache_path)
+    self._children_totals = [None] * len(self.graph)
+
+  @property
+  def rules(self):
+    if self._rules is None:
+      self._parse()
+    return self._rules
+
+  @property
+  def index(self):
+    if self._index is None:
+      self._parse()
+    return self._index
+
+  def _parse(self):
+    self._index = {}
+    with open(self.filename, 'r') as f:
+      self._rules = [LuggageRule(line, self) for line in f if line.strip()]
+
+  def find_ancestors(self, target_type):
+    """
+    Return the set of bag types that can (eventually) contain target_type,
+    found with one breadth-first walk over the reverse edges.
+    """
+    graph = self.graph
+    target = graph.ids.get(target_type)
+    if target is None:
+      return set()
+    seen = bytearray(len(graph))
+    ancestors = []
+    queue = deque([target])
+    while queue:
+      for parent in graph.parents(queue.popleft()):
+        if not seen[parent]:
+          seen[parent] = 1
+          ancestors.append(parent)
+          queue.append(parent)
+    return set([graph.names[bag] for bag in ancestors])
 
   def count_ancestors(self, target_type):
-    return [rule.can_contain(target_type) for rule in self.rules].count(True)
+    return len(self.find_ancestors(target_type))
 
   def count_children(self, target_type):
-    rule = self.index.get(target_type)
-    if rule is None:
+    """
+    Count the bags inside one target_type bag. Totals are memoized and worked
+    out bottom-up with an explicit stack, so deep rule sets do not hit the
+    recursion limit.
+    """
+    graph = self.graph
+    (edge_bag, edge_qty) = (graph.edge_bag, graph.edge_qty)
+    totals = self._children_totals
+    target = graph.ids.get(target_type)
+    if target is None or not graph.has_rule[target]:
       raise Exception('No rule for "%s"' % target_type)
 
-    return sum([
-      contents['qty'] + contents['qty'] * self.count_children(contents['bag_type'])
-      for contents in rule.contents_list
-    ])
+    expanding = bytearray(len(graph))
+    stack = [target]
+    while stack:
+      bag = stack[-1]
+      if totals[bag] is not None:
+        stack.pop()
+        continue
+      if not graph.has_rule[bag]:
+        raise Exception('No rule for "%s"' % graph.names[bag])
+      pending = [edge_bag[edge] for edge in graph.children(bag) if totals[edge_bag[edge]] is None]
+      if pending:
+        if any([expanding[child] for child in pending]):
+          raise Exception('Rules for "%s" are cyclic' % graph.names[bag])
+        expanding[bag] = 1
+        stack.extend(pending)
+        continue
+      expanding[bag] = 0
+      stack.pop()
+      totals[bag] = sum([
+        edge_qty[edge] + edge_qty[edge] * totals[edge_bag[edge]]
+        for edge in graph.children(bag)
+      ])
+
+    return totals[target]
+
+  def topological_order(self):
+    """
+    Order all bag ids so that every bag comes before the bags it contains.
+    """
+    graph = self.graph
+    parent_counts = [0] * len(graph)
+    for child in graph.edge_bag:
+      parent_counts[child] += 1
+    order = [bag for bag in range(len(graph)) if parent_counts[bag] == 0]
+    for bag in order:
+      for edge in graph.children(bag):
+        child = graph.edge_bag[edge]
+        parent_counts[child] -= 1
+        if parent_counts[child] == 0:
+          order.append(child)
+    if len(order) != len(graph):
+      raise Exception('Rules are cyclic')
+    return order
+
+  def batch_stats(self):
+    """
+    Compute the ancestor count and the number of contained bags for every bag
+    type in one pass each over a topological order. Ancestor sets are int
+    bitsets indexed by topological position; child totals are summed from
+    the bottom up. Bags with no rule of their own get a child total of None.
+    """
+    graph = self.graph
+    (edge_bag, edge_qty) = (graph.edge_bag, graph.edge_qty)
+    order = self.topological_order()
+
+    ancestors = [0] * len(graph)
+    for (position, bag) in enumerate(order):
+      inherited = ancestors[bag] | 1 << position
+      for edge in graph.children(bag):
+        ancestors[edge_bag[edge]] |= inherited
+
+    totals = [None] * len(graph)
+    for bag in reversed(order):
+      if not graph.has_rule[bag] or any([totals[edge_bag[edge]] is None for edge in graph.children(bag)]):
+        continue
+      totals[bag] = sum([
+        edge_qty[edge] + edge_qty[edge] * totals[edge_bag[edge]]
+        for edge in graph.children(bag)
+      ])
+
+    return [
+      {'bag_type': graph.names[bag], 'ancestors': bin(ancestors[bag]).count('1'), 'children': totals[bag]}
+      for bag in sorted(range(len(graph)), key=graph.names.__getitem__)
+    ]
+
+def write_batch_stats(stats, f, output_format):
+  if output_format == 'json':
+    json.dump(stats, f, indent=2)
+    f.write('\n')
+  else:
+    writer = csv.DictWriter(f, fieldnames=['bag_type', 'ancestors', 'children'])
+    writer.writeheader()
+    writer.writerows(stats)
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument('filename', help='Path to the file containing rules')
-  parser.add_argument('--mode', choices=['ancestor', 'children'], required=True, help='Count ancestors of the shiny gold bag? Or count children?')
+  parser.add_argument('--mode', choices=['ancestor', 'children', 'batch'], required=True, help='Count ancestors of the shiny gold bag? Or count children? Or both, for every bag type?')
+  parser.add_argument('--format', choices=['csv', 'json'], default='csv', help='Output format for batch mode')
+  parser.add_argument('--output', help='File to write batch mode output to (default: stdout)')
+  parser.add_argument('--cache-dir', help='Directory in which to cache the compiled rules, keyed by the input file contents')
   args = parser.parse_args()
 
-  rules = LuggageRules(args.filename)
+  rules = LuggageRules(args.filename, args.cache_dir)
   if args.mode == 'ancestor':
     print('%d bags can contain a shiny gold bag' % rules.count_ancestors('shiny gold'))
   elif args.mode == 'children':
-    print('A shiny gold bag contains %d other bags' % rules.count_children('shiny gold'))
\ No newline at end of file
+    print('A shiny gold bag contains %d other bags' % rules.count_children('shiny gold'))
+  elif args.mode == 'batch':
+    stats = rules.batch_stats()
+    if args.output is None:
+      write_batch_stats(stats, sys.stdout, args.format)
+    else:
+      with open(args.output, 'w', newline='') as f:
+        write_batch_stats(stats, f, args.format)
\ No newline at end of file
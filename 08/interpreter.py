@@ -6,20 +6,41 @@ https://adventofcode.com/2020/day/8
 """
 
 import argparse
+from array import array
+from collections import deque
 
 class Interpreter:
   CONTINUE = 0
   LOOP = 1
   HALT = 2
-  valid_instructions = frozenset(['acc', 'jmp', 'nop'])
+  # programs are stored as integer opcodes, indexing into OPCODES
+  ACC = 0
+  JMP = 1
+  NOP = 2
+  OPCODES = ('acc', 'jmp', 'nop')
+  OPCODE_IDS = {name: i for (i, name) in enumerate(OPCODES)}
+  valid_instructions = frozenset(OPCODES)
 
   def __init__(self, filename=None):
+    self._dispatch = (self.inst_acc, self.inst_jmp, self.inst_nop)
     if filename is not None:
       self.load(filename)
 
   def load(self, filename):
+    self.opcodes = array('B')
+    self.operands = array('q')
     with open(filename, 'r') as f:
-      self.instructions = [self.parse(line) for line in f.readlines()]
+      for line in f:
+        if not line.strip():
+          continue
+        (opcode, operand) = self.parse(line)
+        self.opcodes.append(Interpreter.OPCODE_IDS[opcode])
+        self.operands.append(operand)
+    # visited[pc] == epoch marks pc as visited in the current run, so reset
+    # only has to bump the epoch
+    self.visited = array('I', bytes(4 * len(self.opcodes)))
+    self.epoch = 0
+    self._blocks = None
 
   def parse(self, line):
     (opcode, operand) = line.split(' ', 1)
@@ -31,29 +52,167 @@ class Interpreter:
       operand = 0
     return (opcode, operand)
 
+  def get_instruction(self, pc):
+    return (Interpreter.OPCODES[self.opcodes[pc]], self.operands[pc])
+
+  @property
+  def instructions(self):
+    return [self.get_instruction(pc) for pc in range(len(self.opcodes))]
+
   def reset(self):
-    self.visited = set()
+    self.epoch += 1
+    if self.epoch > 0xffffffff:
+      self.visited = array('I', bytes(4 * len(self.opcodes)))
+      self.epoch = 1
     self.accumulator = 0
     self.pc = 0
 
-  def exec(self):
-    status = self.next()
-    while status == Interpreter.CONTINUE:
-      status = self.next()
+  def exec(self, profile=None):
+    """
+    Run until the program loops or halts, one basic block at a time (see
+    compile()). If an InterpreterProfile is given, run a separate traced
+    instruction loop that records into it instead, so the untraced loop
+    carries no profiling cost.
+
+    Blocks can only be entered at their first instruction, so the first pc
+    the program revisits is always the start of a block, and marking block
+    starts as visited detects loops at the same pc and accumulator as
+    stepping would.
+    """
+    if profile is not None:
+      return self.exec_profiled(profile)
+    if self._blocks is None:
+      self.compile()
+    (block_at, block_acc, block_next) = self._blocks
+    (visited, epoch) = (self.visited, self.epoch)
+    end = len(self.opcodes)
+    (pc, accumulator) = (self.pc, self.accumulator)
+    while True:
+      if pc >= end:
+        status = Interpreter.HALT
+        break
+      if pc < 0 or block_at[pc] < 0:
+        # not at the start of a block (e.g. after stepping with next()), so
+        # step one instruction at a time until we are
+        (self.pc, self.accumulator) = (pc, accumulator)
+        status = self.next()
+        if status != Interpreter.CONTINUE:
+          return status
+        (pc, accumulator) = (self.pc, self.accumulator)
+        continue
+      if visited[pc] == epoch:
+        status = Interpreter.LOOP
+        break
+      visited[pc] = epoch
+      block = block_at[pc]
+      accumulator += block_acc[block]
+      pc = block_next[block]
+    (self.pc, self.accumulator) = (pc, accumulator)
+    return status
+
+  def exec_instructions(self):
+    """
+    Run until the program loops or halts, one instruction at a time. This is
+    next() inlined into one loop over local variables.
+    """
+    (opcodes, operands, visited, epoch) = (self.opcodes, self.operands, self.visited, self.epoch)
+    (ACC, JMP) = (Interpreter.ACC, Interpreter.JMP)
+    end = len(opcodes)
+    (pc, accumulator) = (self.pc, self.accumulator)
+    while True:
+      if pc >= end:
+        status = Interpreter.HALT
+        break
+      if visited[pc] == epoch:
+        status = Interpreter.LOOP
+        break
+      visited[pc] = epoch
+      opcode = opcodes[pc]
+      if opcode == ACC:
+        accumulator += operands[pc]
+        pc += 1
+      elif opcode == JMP:
+        pc += operands[pc]
+      else:
+        pc += 1
+    (self.pc, self.accumulator) = (pc, accumulator)
+    return status
+
+  def basic_blocks(self):
+    """
+    Split the program into (start, end) ranges of pcs that always run
+    straight through: blocks start at pc 0, at jump targets, and after jumps.
+    """
+    end = len(self.opcodes)
+    leaders = set([0])
+    for pc in range(end):
+      if self.opcodes[pc] == Interpreter.JMP:
+        leaders.add(pc + 1)
+        leaders.add(self.successor(pc))
+    starts = sorted([pc for pc in leaders if 0 <= pc < end])
+    return list(zip(starts, starts[1:] + [end]))
+
+  def compile(self):
+    """
+    Fold every basic block into one accumulator delta and the pc it continues
+    at, indexed by the block's first pc (-1 for pcs inside a block).
+    """
+    block_at = array('l', [-1]) * len(self.opcodes)
+    (block_acc, block_next) = ([], [])
+    for (start, end) in self.basic_blocks():
+      block_at[start] = len(block_acc)
+      block_acc.append(sum([self.operands[pc] for pc in range(start, end) if self.opcodes[pc] == Interpreter.ACC]))
+      block_next.append(self.successor(end - 1))
+    self._blocks = (block_at, block_acc, block_next)
+
+  def toggle(self, pc):
+    """
+    Swap the jmp or nop at pc for the other op.
+    """
+    self.opcodes[pc] = Interpreter.NOP if self.opcodes[pc] == Interpreter.JMP else Interpreter.JMP
+    self._blocks = None
+
+  def exec_profiled(self, profile):
+    (opcodes, operands, visited, epoch) = (self.opcodes, self.operands, self.visited, self.epoch)
+    (ACC, JMP) = (Interpreter.ACC, Interpreter.JMP)
+    (opcode_counts, trace) = (profile.opcode_counts, profile.trace)
+    end = len(opcodes)
+    (pc, accumulator) = (self.pc, self.accumulator)
+    while True:
+      if pc >= end:
+        status = Interpreter.HALT
+        break
+      if visited[pc] == epoch:
+        status = Interpreter.LOOP
+        break
+      visited[pc] = epoch
+      opcode = opcodes[pc]
+      opcode_counts[opcode] += 1
+      if opcode == ACC:
+        accumulator += operands[pc]
+        next_pc = pc + 1
+      elif opcode == JMP:
+        next_pc = pc + operands[pc]
+      else:
+        next_pc = pc + 1
+      if trace is not None:
+        trace.append((pc, Interpreter.OPCODES[opcode], accumulator))
+      pc = next_pc
+    (self.pc, self.accumulator) = (pc, accumulator)
+    profile.status = status
     return status
 
   def next(self):
-    if self.pc in self.visited:
-      return Interpreter.LOOP
-    if self.pc >= len(self.instructions):
+    if self.pc >= len(self.opcodes):
       return Interpreter.HALT
-    self.visited.add(self.pc)
-    (opcode, operand) = self.instructions[self.pc]
-    self.dispatch_instruction(opcode, operand)
+    if self.visited[self.pc] == self.epoch:
+      return Interpreter.LOOP
+    self.visited[self.pc] = self.epoch
+    self.dispatch_instruction(self.opcodes[self.pc], self.operands[self.pc])
     return Interpreter.CONTINUE
 
   def dispatch_instruction(self, opcode, operand):
-    getattr(self, 'inst_%s' % opcode)(operand)
+    self._dispatch[opcode](operand)
 
   def set_pc(self, new_pc):
     self.pc = new_pc
@@ -71,28 +230,163 @@ class Interpreter:
   def does_halt(self):
     return self.exec() == Interpreter.HALT
 
+  def successor(self, pc, opcode=None):
+    if opcode is None:
+      opcode = self.opcodes[pc]
+    return pc + self.operands[pc] if opcode == Interpreter.JMP else pc + 1
+
+  def find_halting_pcs(self):
+    """
+    Return a bytearray with a 1 for every pc from which the unmodified program
+    halts. Built by walking the reverse edges back from the instructions
+    that step past the end of the program.
+    """
+    end = len(self.opcodes)
+    predecessor_counts = [0] * (end + 1)
+    successors = [self.successor(pc) for pc in range(end)]
+    for target in successors:
+      if 0 <= target < end:
+        predecessor_counts[target + 1] += 1
+    for pc in range(end):
+      predecessor_counts[pc + 1] += predecessor_counts[pc]
+    predecessors = array('l', bytes(array('l').itemsize * end))
+    fill = predecessor_counts[:]
+    for (pc, target) in enumerate(successors):
+      if 0 <= target < end:
+        predecessors[fill[target]] = pc
+        fill[target] += 1
+
+    halts = bytearray(end)
+    queue = [pc for (pc, target) in enumerate(successors) if target >= end]
+    for pc in queue:
+      halts[pc] = 1
+    for pc in queue:
+      for predecessor in predecessors[predecessor_counts[pc]:predecessor_counts[pc + 1]]:
+        if not halts[predecessor]:
+          halts[predecessor] = 1
+          queue.append(predecessor)
+    return halts
+
   def find_halt(self):
     """
     Find a jmp or nop that, when toggled to the other op, allows the program to
     halt. Return the pc of that instruction, or -1 if the program already halts
+
+    Only instructions on the original execution path can matter, and toggling
+    one of them fixes the program exactly when its toggled successor halts in
+    the unmodified program (the toggled pc itself cannot halt, or the program
+    would already halt). So one reachability pass and one run find every
+    fix; the lowest pc is returned, matching find_halt_brute_force. The fix is
+    left applied and the program is run to set the accumulator. If there is
+    no fix, the unmodified program is run instead.
+    """
+    halts = self.find_halting_pcs()
+    end = len(self.opcodes)
+    if end == 0 or halts[0]:
+      self.reset()
+      self.exec()
+      return -1
+
+    fixed_pc = None
+    visited = bytearray(end)
+    pc = 0
+    while 0 <= pc < end and not visited[pc]:
+      visited[pc] = 1
+      (opcode, operand) = (self.opcodes[pc], self.operands[pc])
+      if opcode == Interpreter.JMP or (opcode == Interpreter.NOP and operand != 0):
+        target = self.successor(pc, Interpreter.NOP if opcode == Interpreter.JMP else Interpreter.JMP)
+        if (target >= end or (target >= 0 and halts[target])) and (fixed_pc is None or pc < fixed_pc):
+          fixed_pc = pc
+      pc = self.successor(pc)
+    if fixed_pc is None:
+      # leave the accumulator set from a run of the unmodified program
+      self.reset()
+      self.exec()
+      return None
+
+    self.toggle(fixed_pc)
+    self.reset()
+    self.exec()
+    return fixed_pc
+
+  def find_halt_brute_force(self):
+    """
+    Same as find_halt, but found by toggling each candidate in turn and
+    re-running the whole program. Quadratic; kept for cross-checking.
     """
     self.reset()
     if self.does_halt():
       return -1
-    for pc in range(len(self.instructions)):
-      (opcode, operand) = self.instructions[pc]
+    for pc in range(len(self.opcodes)):
+      (opcode, operand) = (self.opcodes[pc], self.operands[pc])
       # We're interested in trying any jmp, but only nops that wouldn't become self-jmps
-      if opcode == 'jmp' or (opcode == 'nop' and operand != 0):
-        self.instructions[pc] = ('nop' if opcode == 'jmp' else 'jmp', operand)
+      if opcode == Interpreter.JMP or (opcode == Interpreter.NOP and operand != 0):
+        self.toggle(pc)
         self.reset()
         if self.does_halt():
           return pc
-        self.instructions[pc] = (opcode, operand)
+        self.toggle(pc)
+
+class InterpreterProfile:
+  """
+  Execution statistics gathered by Interpreter.exec(profile=...): how often
+  each opcode ran, how the run ended, and optionally the last trace_len (pc,
+  opcode, accumulator after) states. A run stops the first time a pc comes
+  around again, so every instruction runs at most once; for a run that
+  loops, the useful picture is the cycle it would repeat forever.
+  """
+  def __init__(self, interpreter, trace_len=0):
+    self.interpreter = interpreter
+    self.opcode_counts = [0] * len(Interpreter.OPCODES)
+    self.trace = deque(maxlen=trace_len) if trace_len > 0 else None
+    self.status = None
+
+  def steps(self):
+    return sum(self.opcode_counts)
+
+  def loop_cycle(self):
+    """
+    Return the pcs of the cycle the program is stuck in, starting at the pc
+    that was about to run a second time, or None if the run did not loop.
+    """
+    if self.status != Interpreter.LOOP:
+      return None
+    interpreter = self.interpreter
+    start = interpreter.pc
+    cycle = [start]
+    pc = interpreter.successor(start)
+    while pc != start:
+      cycle.append(pc)
+      pc = interpreter.successor(pc)
+    return cycle
+
+  def print_report(self):
+    status = {Interpreter.LOOP: 'loop', Interpreter.HALT: 'halt'}.get(self.status, 'unknown')
+    print('Profile: %d steps, ended in %s' % (self.steps(), status))
+    print('Opcode counts: %s' % ', '.join(['%s %d' % (name, n) for (name, n) in zip(Interpreter.OPCODES, self.opcode_counts)]))
+    cycle = self.loop_cycle()
+    if cycle is not None:
+      interpreter = self.interpreter
+      gain = sum([interpreter.operands[pc] for pc in cycle if interpreter.opcodes[pc] == Interpreter.ACC])
+      print('Loop: %d instructions, accumulator %+d per iteration' % (len(cycle), gain))
+      # print the cycle as runs of consecutive pcs, in execution order
+      start = cycle[0]
+      for (prev, pc) in zip(cycle, cycle[1:] + [cycle[0]]):
+        if pc != prev + 1:
+          span = '%d' % start if start == prev else '%d-%d' % (start, prev)
+          print('  pc %s -> %d' % (span, pc))
+          start = pc
+    if self.trace is not None:
+      print('Last %d states (pc, opcode, accumulator):' % len(self.trace))
+      for (pc, opcode, accumulator) in self.trace:
+        print('  %d %s %d' % (pc, opcode, accumulator))
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument('filename', help='Path to the code file')
   parser.add_argument('--mode', choices=['find_loop', 'find_halt'], required=True, help='Find first loop? or find first halt?')
+  parser.add_argument('--profile', action='store_true', help='Re-run the final program with profiling and print a report')
+  parser.add_argument('--trace-len', type=int, default=10, help='With --profile, number of most recent states to dump')
   args = parser.parse_args()
 
   interpreter = Interpreter(args.filename)
@@ -106,8 +400,18 @@ if __name__ == '__main__':
       print('Accumulator before loop: %d' % interpreter.accumulator)
   elif args.mode == 'find_halt':
     fixed_pc = interpreter.find_halt()
-    if fixed_pc == -1:
-      print('Already halts')
+    if fixed_pc is None:
+      print('No single changed instruction allows halt')
+      print('Accumulator before loop: %d' % interpreter.accumulator)
     else:
-      print('Changed instruction %d (%s %d) to allow halt' % (fixed_pc, *interpreter.instructions[fixed_pc]))
-    print('Accumulator at halt: %d' % interpreter.accumulator)
\ No newline at end of file
+      if fixed_pc == -1:
+        print('Already halts')
+      else:
+        print('Changed instruction %d (%s %d) to allow halt' % (fixed_pc, *interpreter.get_instruction(fixed_pc)))
+      print('Accumulator at halt: %d' % interpreter.accumulator)
+
+  if args.profile:
+    profile = InterpreterProfile(interpreter, args.trace_len)
+    interpreter.reset()
+    interpreter.exec(profile)
+    profile.print_report()
\ No newline at end of file
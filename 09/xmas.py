@@ -2,86 +2,214 @@
 """
 Crack the XMAS encoding.
 
+With --monitor, instead watch a stream of numbers (stdin by default) for as
+long as it runs, reporting every invalid number and a recent contiguous range
+that sums to it.
+
 https://adventofcode.com/2020/day/9
 """
 
-import argparse
+import argparse, sys, time
+from collections import Counter, deque
+from itertools import islice
+
+class Window:
+  """
+  The last n numbers of the stream, kept both in arrival order (a deque, so
+  the oldest can be dropped in O(1)) and as a multiset (a Counter, so pair
+  sums can be checked with one lookup per distinct value).
+  """
+  def __init__(self, numbers):
+    self.numbers = deque(numbers)
+    self.counts = Counter(self.numbers)
+
+  def push(self, new_number):
+    """
+    Add the new number and drop the oldest one.
+    """
+    drop = self.numbers.popleft()
+    self.numbers.append(new_number)
+    self.counts[drop] -= 1
+    if self.counts[drop] == 0:
+      del self.counts[drop]
+    self.counts[new_number] += 1
+
+  def is_valid(self, number):
+    """
+    Determine whether number is the sum of two entries of the window (two
+    different entries, though they may have the same value).
+    """
+    counts = self.counts
+    for x in counts:
+      y = number - x
+      if y in counts and (y != x or counts[x] > 1):
+        return True
+    return False
 
 def fetch_preamble(file, n):
   """
-  Given a file, read the first n numbers. Sort the list for faster search.
-  Return both the original list and the sorted list as a tuple.
+  Given a file, read the first n numbers into a Window.
   """
-  numbers = []
-  while len(numbers) < n:
-    numbers.append(fetch_next(file))
-  return (numbers, sorted(numbers))
+  return Window([fetch_next(file) for _ in range(n)])
 
 def fetch_next(file):
   return int(file.readline())
 
-def update(ls, new_number):
+def update(window, new_number):
   """
-  Given a tuple of original list and sorted list, add the new number to the
-  lists and drop the oldest number. Return the updated tuple. (they are also
-  updated by reference).
+  Add the new number to the window and drop the oldest number. Return the
+  window (it is also updated in place).
   """
-  (numbers, sorted_numbers) = ls
-  drop = numbers[0]
-  numbers = numbers[1:] + [new_number]
-  sorted_numbers.remove(drop) # ok for there to be duplicates b/c we just remove the first one!
-  sorted_numbers.append(new_number)
-  sorted_numbers.sort() # would be more efficient to iterate once and insert/remove but who cares
-  return (numbers, sorted_numbers)
-
-def is_valid(ls, number):
+  window.push(new_number)
+  return window
+
+def is_valid(window, number):
   """
-  Given a tuple of original list and sorted list, determine whether the next
-  number is valid (ie, is a sum of some pair in the list)
+  Given a window, determine whether the next number is valid (ie, is a sum of
+  some pair in the window)
   """
-  (numbers, sorted_numbers) = ls
-  for i in range(len(sorted_numbers) - 1, 0, -1):
-    if sorted_numbers[i] > number:
-      continue
-    for j in range(0, i):
-      if sorted_numbers[i] + sorted_numbers[j] == number:
-        return True
-
-  return False
+  return window.is_valid(number)
 
 def find_range(file, target):
   """
   Given a file, read numbers to find a contiguous list of numbers that sums to
-  the given target number. Return the list.
+  the given target number. Return the list. The running sum of the current
+  range is updated as numbers enter and leave it, so this is O(n) overall.
   """
-  numbers = []
-  candidate = sum(numbers)
+  numbers = deque()
+  candidate = 0
   while candidate != target:
     if candidate > target:
-      numbers.pop(0)
+      candidate -= numbers.popleft()
     else:
-      numbers.append(fetch_next(file))
-    candidate = sum(numbers)
+      number = fetch_next(file)
+      numbers.append(number)
+      candidate += number
 
-  return numbers
+  return list(numbers)
+
+class XmasMonitor:
+  """
+  Check an unbounded stream of numbers in bounded memory. Only the window and
+  the last history_len numbers (with their prefix sums) are kept, so a range
+  summing to an invalid number is looked up in that history instead of by
+  re-reading the stream.
+  """
+  def __init__(self, tail_len=25, history_len=100000):
+    self.tail_len = tail_len
+    self.window = None
+    self.preamble = []
+    self.offset = 0
+    self.invalid_count = 0
+    # history holds the numbers at offsets [offset - len(history), offset);
+    # prefixes[i] is the sum of every number before history[i], plus one
+    # final entry for the sum of everything
+    self.history = deque()
+    self.history_len = history_len
+    self.prefixes = deque([0])
+    self.prefix_offsets = {0: 0}
+
+  def feed(self, number):
+    """
+    Process the next number of the stream. If it is invalid, return a tuple
+    of its offset, the number, and the (first offset, numbers) of a range of
+    at least two numbers from the history that sums to it, or None for the
+    range if the history has none.
+    """
+    offset = self.offset
+    report = None
+    if self.window is None:
+      self.preamble.append(number)
+      if len(self.preamble) == self.tail_len:
+        self.window = Window(self.preamble)
+        self.preamble = None
+    else:
+      if not self.window.is_valid(number):
+        self.invalid_count += 1
+        report = (offset, number, self.find_recent_range(number))
+      self.window.push(number)
+    self.remember(number)
+    return report
+
+  def remember(self, number):
+    self.offset += 1
+    total = self.prefixes[-1] + number
+    self.history.append(number)
+    self.prefixes.append(total)
+    self.prefix_offsets[total] = self.offset
+    if len(self.history) > self.history_len:
+      self.history.popleft()
+      dropped = self.prefixes.popleft()
+      if self.prefix_offsets.get(dropped) == self.offset - len(self.history) - 1:
+        del self.prefix_offsets[dropped]
+
+  def find_recent_range(self, target):
+    """
+    Find offsets start < end with prefix(end) - prefix(start) == target and
+    end - start >= 2, using the prefix sum index. Return (start, numbers), or
+    None. For streams with repeated prefix sums (zeros or negative numbers)
+    only the latest occurrence of each prefix sum is considered.
+    """
+    base = self.offset - len(self.history)
+    for (i, total) in enumerate(self.prefixes):
+      start = self.prefix_offsets.get(total - target)
+      end = base + i
+      if start is not None and start <= end - 2:
+        return (start, list(islice(self.history, start - base, end - base)))
+    return None
+
+def monitor(stream, tail_len, history_len, stats_interval):
+  xmas_monitor = XmasMonitor(tail_len, history_len)
+  started = last_stats = time.monotonic()
+  for line in stream:
+    if not line.strip():
+      continue
+    report = xmas_monitor.feed(int(line))
+    if report is not None:
+      (offset, number, found) = report
+      print('Invalid number at offset %d: %d' % (offset, number))
+      if found is None:
+        print('  No range in the last %d numbers sums to it' % history_len)
+      else:
+        (start, contig) = found
+        print('  Range at offsets %d-%d sums to it, XMAS value: %d' % (start, start + len(contig) - 1, min(contig) + max(contig)))
+      sys.stdout.flush()
+    # checking the clock every number would cost more than the check itself
+    if stats_interval > 0 and xmas_monitor.offset % 4096 == 0:
+      now = time.monotonic()
+      if now - last_stats >= stats_interval:
+        print('%d numbers, %d invalid, %.0f numbers/s' % (xmas_monitor.offset, xmas_monitor.invalid_count, xmas_monitor.offset / (now - started)), file=sys.stderr)
+        last_stats = now
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description=__doc__)
-  parser.add_argument('filename', help='Path to the file containing XMAS data')
+  parser.add_argument('filename', nargs='?', default='-', help='Path to the file containing XMAS data ("-" for stdin, only with --monitor)')
   parser.add_argument('--tail-len', type=int, default=25, help='Length of preamble/previous N numbers to consider')
+  parser.add_argument('--monitor', action='store_true', help='Report every invalid number in the stream instead of stopping at the first')
+  parser.add_argument('--history-len', type=int, default=100000, help='With --monitor, how many recent numbers to search for ranges')
+  parser.add_argument('--stats-interval', type=float, default=10, help='With --monitor, seconds between throughput reports on stderr (0 to disable)')
   args = parser.parse_args()
+  if not args.monitor and args.filename == '-':
+    parser.error('a filename is required unless --monitor is given')
 
-  with open(args.filename, 'r') as f:
-    tail = fetch_preamble(f, args.tail_len)
-    number = fetch_next(f)
-    while(is_valid(tail, number)):
-      tail = update(tail, number)
+  if args.monitor:
+    if args.filename == '-':
+      monitor(sys.stdin, args.tail_len, args.history_len, args.stats_interval)
+    else:
+      with open(args.filename, 'r') as f:
+        monitor(f, args.tail_len, args.history_len, args.stats_interval)
+  else:
+    with open(args.filename, 'r') as f:
+      tail = fetch_preamble(f, args.tail_len)
       number = fetch_next(f)
-    target_number = number
-    print('Invalid number (target):', target_number)
-
-    f.seek(0)
-    contig = find_range(f, target_number)
-    print('Found range that sums to target number:', contig)
-    xmas = min(contig) + max(contig)
-    print('XMAS value:', xmas)
\ No newline at end of file
+      while(is_valid(tail, number)):
+        tail = update(tail, number)
+        number = fetch_next(f)
+      target_number = number
+      print('Invalid number (target):', target_number)
+
+      f.seek(0)
+      contig = find_range(f, target_number)
+      print('Found range that sums to target number:', contig)
+      xmas = min(contig) + max(contig)
+      print('XMAS value:', xmas)
\ No newline at end of file
@@ -6,40 +6,299 @@ between each adapter.
 https://adventofcode.com/2020/day/10
 """
 
-import argparse
+import argparse, random
+from operator import mul
+from collections import Counter, deque
 
 def read_joltages(filename):
   with open(filename, 'r') as f:
-    return sorted([int(line) for line in f.readlines()])
+    return sorted(map(int, f.read().split()))
 
-def jolt_stats(joltages):
-  gaps = { 1: 0, 2: 0, 3: 0 }
+def jolt_stats(joltages, max_gap=3):
+  """
+  Count the gaps between consecutive adapters and the number of ways to
+  arrange them. joltages must be sorted. The arrangement counts are kept for
+  the adapters within max_gap of the current one only, so memory does not
+  depend on how large the joltages are.
+  """
+  gaps = {gap: 0 for gap in range(1, max_gap + 1)}
   prev = 0 # first joltage is 0
-  variant_counts = [1] + [0] * joltages[-1]
+  # (joltage, number of ways to reach it) for the recent adapters that can still connect
+  recent = deque([(0, 1)])
+  # sum of the counts in recent
+  window_total = 1
   for joltage in joltages:
     gap = joltage - prev
     if gap not in gaps:
       raise Exception('Invalid joltage gap!')
     gaps[gap] += 1
-    variant_counts[joltage] = sum([variant_counts[joltage - step] for step in range(1, 4)])
+    while joltage - recent[0][0] > max_gap:
+      window_total -= recent.popleft()[1]
+    ways = window_total
+    recent.append((joltage, ways))
+    window_total += ways
     prev = joltage
 
-  # last joltage is +3
-  gaps[3] += 1
+  # last joltage is +max_gap
+  gaps[max_gap] += 1
 
   return {
     'gaps': gaps,
-    'variants': variant_counts[-1]
+    'variants': recent[-1][1]
   }
 
+def mat_mul(a, b):
+  columns = tuple(zip(*b))
+  return tuple([
+    tuple([sum(map(mul, a_row, column)) for column in columns])
+    for a_row in a
+  ])
+
+def identity(size):
+  return tuple([tuple([int(i == j) for j in range(size)]) for i in range(size)])
+
+class AdapterNode:
+  def __init__(self, joltage):
+    self.joltage = joltage
+    self.priority = random.random()
+    self.left = None
+    self.right = None
+    self.size = 1
+    self.mat = None
+    self.agg = None
+
+class AdapterChain:
+  """
+  Adapter inventory that supports inserting and removing adapters and
+  answers the arrangement count and gap histogram after every change in
+  O(max_gap^3 log n) expected time.
+
+  The arrangement count is a product of transfer matrices. The state after
+  an adapter is the vector of arrangement counts for it and the max_gap - 1
+  adapters before it (the source counts as an adapter at 0 jolts). Adapter
+  i's matrix computes its count from the adapters before it that are within
+  max_gap jolts and shifts the rest along. Since joltages are distinct, only
+  the max_gap previous adapters can be in range. The adapters are kept in a
+  treap (a randomized balanced search tree) ordered by joltage, where every
+  node also stores the product of the matrices in its subtree. An edit
+  changes the matrices of at most max_gap neighboring adapters, so only
+  those nodes and their ancestors are recomputed.
+  """
+  def __init__(self, joltages=(), max_gap=3):
+    self.max_gap = max_gap
+    self._identity = identity(max_gap)
+    self._gaps = Counter()
+    self.root = None
+
+    joltages = sorted(joltages)
+    nodes = [AdapterNode(joltage) for joltage in joltages]
+    prev = 0
+    for node in nodes:
+      if node.joltage <= prev:
+        raise Exception('Duplicate or non-positive adapter: %d' % node.joltage)
+      self._gaps[node.joltage - prev] += 1
+      prev = node.joltage
+    self._set_matrices([0], nodes)
+
+    # build the treap in O(n) with the usual stack-based Cartesian tree construction
+    stack = []
+    for node in nodes:
+      last = None
+      while stack and stack[-1].priority < node.priority:
+        last = stack.pop()
+      node.left = last
+      if stack:
+        stack[-1].right = node
+      stack.append(node)
+    self.root = stack[0] if stack else None
+    self._update_all(self.root)
+
+  def __len__(self):
+    return self._size(self.root)
+
+  def _size(self, node):
+    return node.size if node is not None else 0
+
+  def _agg(self, node):
+    return node.agg if node is not None else self._identity
+
+  def _update(self, node):
+    node.size = 1 + self._size(node.left) + self._size(node.right)
+    agg = node.mat
+    if node.right is not None:
+      agg = mat_mul(node.right.agg, agg)
+    if node.left is not None:
+      agg = mat_mul(agg, node.left.agg)
+    node.agg = agg
+
+  def _update_all(self, node):
+    if node is None:
+      return
+    self._update_all(node.left)
+    self._update_all(node.right)
+    self._update(node)
+
+  def _split_key(self, node, joltage):
+    """
+    Split into (adapters below joltage, adapters at or above joltage).
+    """
+    if node is None:
+      return (None, None)
+    if node.joltage < joltage:
+      (node.right, right) = self._split_key(node.right, joltage)
+      self._update(node)
+      return (node, right)
+    (left, node.left) = self._split_key(node.left, joltage)
+    self._update(node)
+    return (left, node)
+
+  def _split_count(self, node, count):
+    """
+    Split into (the first count adapters, the rest).
+    """
+    if node is None:
+      return (None, None)
+    if self._size(node.left) < count:
+      (node.right, right) = self._split_count(node.right, count - self._size(node.left) - 1)
+      self._update(node)
+      return (node, right)
+    (left, node.left) = self._split_count(node.left, count)
+    self._update(node)
+    return (left, node)
+
+  def _merge(self, left, right):
+    if left is None:
+      return right
+    if right is None:
+      return left
+    if left.priority > right.priority:
+      left.right = self._merge(left.right, right)
+      self._update(left)
+      return left
+    right.left = self._merge(left, right.left)
+    self._update(right)
+    return right
+
+  def _nodes(self, node):
+    if node is None:
+      return []
+    return self._nodes(node.left) + [node] + self._nodes(node.right)
+
+  def _set_matrices(self, before, nodes):
+    """
+    Recompute the transfer matrices of nodes, given the joltages that come
+    right before the first of them (starting with the source's 0 if the
+    nodes are near the start of the chain).
+    """
+    max_gap = self.max_gap
+    recent = list(before[-max_gap:])
+    for node in nodes:
+      # recent[-1 - k] is the k-th adapter before this one
+      first_row = tuple([
+        int(k < len(recent) and node.joltage - recent[-1 - k] <= max_gap)
+        for k in range(max_gap)
+      ])
+      node.mat = (first_row,) + self._identity[:-1]
+      recent = (recent + [node.joltage])[-max_gap:]
+
+  def _isolate(self, joltage):
+    """
+    Split the treap into (head, below, upper): below holds the max_gap
+    adapters just under joltage, head everything before them, and upper
+    every adapter at or above joltage.
+    """
+    (lower, upper) = self._split_key(self.root, joltage)
+    (head, below) = self._split_count(lower, self._size(lower) - self.max_gap)
+    return (head, below, upper)
+
+  def insert(self, joltage):
+    if joltage <= 0:
+      raise Exception('Non-positive adapter: %d' % joltage)
+    (head, below, upper) = self._isolate(joltage)
+    (affected, tail) = self._split_count(upper, self.max_gap)
+    affected_nodes = self._nodes(affected)
+    if affected_nodes and affected_nodes[0].joltage == joltage:
+      self.root = self._merge(self._merge(head, below), self._merge(affected, tail))
+      raise Exception('Duplicate adapter: %d' % joltage)
+
+    before = ([0] if head is None else []) + [node.joltage for node in self._nodes(below)]
+    node = AdapterNode(joltage)
+    self._set_matrices(before, [node] + affected_nodes)
+    self._update(node)
+    self._update_all(affected)
+
+    prev = before[-1]
+    self._gaps[joltage - prev] += 1
+    if affected_nodes:
+      self._gaps[affected_nodes[0].joltage - prev] -= 1
+      self._gaps[affected_nodes[0].joltage - joltage] += 1
+
+    self.root = self._merge(self._merge(head, below), self._merge(self._merge(node, affected), tail))
+
+  def remove(self, joltage):
+    (head, below, upper) = self._isolate(joltage)
+    (target, upper) = self._split_count(upper, 1)
+    if target is None or target.joltage != joltage:
+      self.root = self._merge(self._merge(head, below), self._merge(target, upper))
+      raise Exception('No adapter: %d' % joltage)
+    (affected, tail) = self._split_count(upper, self.max_gap)
+    affected_nodes = self._nodes(affected)
+
+    before = ([0] if head is None else []) + [node.joltage for node in self._nodes(below)]
+    self._set_matrices(before, affected_nodes)
+    self._update_all(affected)
+
+    prev = before[-1]
+    self._gaps[joltage - prev] -= 1
+    if affected_nodes:
+      self._gaps[affected_nodes[0].joltage - joltage] -= 1
+      self._gaps[affected_nodes[0].joltage - prev] += 1
+
+    self.root = self._merge(self._merge(head, below), self._merge(affected, tail))
+
+  def arrangements(self):
+    return self._agg(self.root)[0][0]
+
+  def gaps(self):
+    """
+    Return the histogram of gaps between consecutive joltages, from the
+    source through the device (which is always max_gap above the last
+    adapter). Gaps larger than max_gap leave the chain with no arrangements.
+    """
+    gaps = {gap: 0 for gap in range(1, self.max_gap + 1)}
+    for (gap, count) in self._gaps.items():
+      if count:
+        gaps[gap] = count
+    # the device is always max_gap above the last adapter
+    gaps[self.max_gap] += 1
+    return gaps
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument('filename', help='Path to the file of joltage adapter info')
+  parser.add_argument('--max-gap', type=int, default=3, help='Largest joltage gap an adapter can bridge')
+  parser.add_argument('--edits', help='File of inventory edits ("+N" adds an N-jolt adapter, "-N" removes one) to apply one by one, reporting after each')
   args = parser.parse_args()
 
   joltages = read_joltages(args.filename)
-  stats = jolt_stats(joltages)
+  stats = jolt_stats(joltages, args.max_gap)
   gaps = stats['gaps']
-  print('1-gaps:', gaps[1], '2-gaps:', gaps[2], '3-gaps:', gaps[3])
-  print('1-gaps * 3-gaps:', gaps[1] * gaps[3])
+  print(' '.join(['%d-gaps: %d' % (gap, count) for (gap, count) in gaps.items()]))
+  print('1-gaps * %d-gaps:' % args.max_gap, gaps[1] * gaps[args.max_gap])
   print('Variants:', stats['variants'])
+
+  if args.edits is not None:
+    chain = AdapterChain(joltages, args.max_gap)
+    with open(args.edits, 'r') as f:
+      for line in f:
+        edit = line.strip()
+        if not edit:
+          continue
+        if edit[0] == '+':
+          chain.insert(int(edit[1:]))
+        elif edit[0] == '-':
+          chain.remove(int(edit[1:]))
+        else:
+          raise Exception('Invalid edit: %s' % edit)
+        gaps = chain.gaps()
+        print('%s: %s, variants: %d' % (edit, ' '.join(['%d-gaps: %d' % (gap, count) for (gap, count) in gaps.items()]), chain.arrangements()))
\ No newline at end of file
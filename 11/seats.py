@@ -6,106 +6,441 @@ https://adventofcode.com/2020/day/11
 """
 
 import argparse
+from array import array
+from multiprocessing import Array, Barrier, Process
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+from operator import ne
 
 class SeatSimulation:
   FLOOR = '.'
   SEAT = 'L'
   OCCUPIED = '#'
 
-  def __init__(self, filename):
-    self.neighbor_tolerance = 4
+  def __init__(self, filename, neighbor_tolerance=4):
+    self.neighbor_tolerance = neighbor_tolerance
+    # the transition table only depends on the tolerance, so build it once
+    self._transition = self.transitions().__getitem__
     self.load(filename)
     self.initialize_state()
 
   def load(self, filename):
+    """
+    Read the layout. The grid is also stored flattened, with a border of
+    floor around it so that every cell has eight neighbors: cell (i, j) is
+    at index (i + 1) * stride + j + 2, and one extra cell at each end keeps
+    the corner neighbors of the border in range.
+    """
     with open(filename, 'r') as f:
-      self.layout = [[c for c in line if c != '\n'] for line in f.readlines()]
+      self.layout = [[c for c in line if c != '\n'] for line in f.readlines() if line.strip()]
+
+    self.height = len(self.layout)
+    self.width = max([len(row) for row in self.layout], default=0)
+    self.stride = self.width + 2
+    self.seats = bytearray(self.stride * (self.height + 2) + 2)
+    for (i, row) in enumerate(self.layout):
+      for (j, c) in enumerate(row):
+        if c != SeatSimulation.FLOOR:
+          self.seats[self.index(i, j)] = 1
+    stride = self.stride
+    self.neighbor_offsets = (-stride - 1, -stride, -stride + 1, -1, 1, stride - 1, stride, stride + 1)
+    # the slice of the flat grid that holds the real rows
+    (self.first, self.last) = (stride + 1, stride * (self.height + 1) + 1)
+
+  def index(self, row_idx, seat_idx):
+    return (row_idx + 1) * self.stride + seat_idx + 2
 
   def copy_state(self, state):
     return [row[:] for row in state]
 
   def initialize_state(self):
-    self.state = self.copy_state(self.layout)
+    self.occupied = bytearray(len(self.seats))
+    for (i, row) in enumerate(self.layout):
+      for (j, c) in enumerate(row):
+        if c == SeatSimulation.OCCUPIED:
+          self.occupied[self.index(i, j)] = 1
+
+  def rows_from(self, occupied):
+    rows = []
+    for (i, layout_row) in enumerate(self.layout):
+      row = []
+      for (j, c) in enumerate(layout_row):
+        if c == SeatSimulation.FLOOR:
+          row.append(SeatSimulation.FLOOR)
+        else:
+          row.append(SeatSimulation.OCCUPIED if occupied[self.index(i, j)] else SeatSimulation.SEAT)
+      rows.append(row)
+    return rows
+
+  @property
+  def state(self):
+    return self.rows_from(self.occupied)
+
+  @state.setter
+  def state(self, state):
+    self.occupied = bytearray(len(self.seats))
+    for (i, row) in enumerate(state):
+      for (j, c) in enumerate(row):
+        if c == SeatSimulation.OCCUPIED:
+          self.occupied[self.index(i, j)] = 1
 
   def print_state(self):
     for row in self.state:
       print(''.join(row))
     print('\n')
 
-  def run_til_settled(self):
-    next_state = self.calc_next_state()
-    while next_state != self.state:
-      self.state = next_state
-      next_state = self.calc_next_state()
+  def run_til_settled(self, jobs=1):
+    if jobs > 1 and self.height > 1:
+      self.run_banded(jobs)
+      return
+    while self.step() != 0:
+      pass
+
+  def bands(self, jobs):
+    """
+    Split the real rows into up to jobs horizontal bands. Return the (start,
+    end) range of flat cells that each band covers.
+    """
+    jobs = min(jobs, self.height)
+    rows = [self.height * k // jobs for k in range(jobs + 1)]
+    return [
+      (self.first + rows[k] * self.stride, self.first + rows[k + 1] * self.stride)
+      for k in range(jobs)
+    ]
+
+  def run_banded(self, jobs):
+    """
+    Run until settled with each band of rows stepped by its own process. The
+    occupancy is double-buffered in shared memory: every generation reads
+    one buffer and writes the other, so the rows just outside a band (its
+    halo) are read straight from the neighboring bands' previous generation.
+    The workers meet at a barrier once per generation, and each one sums
+    every band's changed count to decide whether the grid has settled. If a
+    worker fails, the barrier is aborted so that the others stop too. Each
+    worker steps its band with the function from band_stepper.
+    """
+    bands = self.bands(jobs)
+    size = len(self.seats)
+    buffers = [SharedMemory(create=True, size=size) for _ in range(2)]
+    try:
+      for shm in buffers:
+        shm.buf[:size] = bytes(size)
+      buffers[0].buf[:size] = self.occupied
+      # changed counts, one set per generation parity
+      changed = Array('q', 2 * len(bands), lock=False)
+      barrier = Barrier(len(bands))
+      workers = [
+        Process(target=step_band, args=(self, [shm.name for shm in buffers], band, k, len(bands), changed, barrier))
+        for (k, band) in enumerate(bands)
+      ]
+      for worker in workers:
+        worker.start()
+      pending = {worker.sentinel: worker for worker in workers}
+      while pending:
+        for sentinel in wait(list(pending)):
+          worker = pending.pop(sentinel)
+          worker.join()
+          if worker.exitcode != 0:
+            # the other workers would wait for it at the barrier forever
+            barrier.abort()
+      if any(worker.exitcode != 0 for worker in workers):
+        raise Exception('A band worker failed')
+      # once settled, both buffers hold the same occupancy
+      self.occupied = bytearray(buffers[0].buf[:size])
+    finally:
+      for shm in buffers:
+        shm.close()
+        shm.unlink()
+
+  def band_stepper(self, first, last):
+    """
+    Return a function that computes the next generation of the cells from
+    first to last, reading src and writing dst, and returns the number of
+    them that changed. Used by the band workers of run_banded.
+    """
+    def step(src, dst):
+      (nxt, changed) = self.next_cells(src, first, last)
+      dst[first:last] = nxt
+      return changed
+    return step
+
+  def step(self):
+    """
+    Advance one generation. Return the number of seats that changed.
+    """
+    (self.occupied, changed) = self.next_occupied()
+    return changed
 
   def count_occupied(self):
-    return sum([row.count(SeatSimulation.OCCUPIED) for row in self.state])
+    return self.occupied.count(1)
+
+  def neighbor_counts(self, occupied, first=None, last=None):
+    """
+    Count the occupied neighbors of every cell from first to last (by
+    default self.first to self.last), all at once: each of the eight shifted
+    slices of the grid lines up one neighbor with every cell, and the slices
+    are summed element-wise.
+    """
+    if first is None:
+      (first, last) = (self.first, self.last)
+    shifted = [occupied[first + offset:last + offset] for offset in self.neighbor_offsets]
+    return bytes(map(sum, zip(*shifted)))
+
+  def transitions(self):
+    """
+    Map (is seat, is occupied, occupied neighbors) to whether the cell is
+    occupied in the next generation.
+    """
+    return {
+      (seat, occupied, count): int(seat == 1 and (count < self.neighbor_tolerance if occupied else count == 0))
+      for seat in (0, 1) for occupied in (0, 1) for count in range(9)
+    }
+
+  def next_cells(self, occupied, first, last):
+    """
+    Compute the next generation of the cells from first to last. Return
+    their new occupancy and the number of them that changed.
+    """
+    current = occupied[first:last]
+    counts = self.neighbor_counts(occupied, first, last)
+    nxt = bytes(map(self._transition, zip(self.seats[first:last], current, counts)))
+    return (nxt, sum(map(ne, nxt, current)))
+
+  def next_occupied(self):
+    """
+    Compute the next generation's occupancy grid. Return it and the number
+    of cells that changed.
+    """
+    (first, last) = (self.first, self.last)
+    (nxt, changed) = self.next_cells(self.occupied, first, last)
+    occupied = bytearray(len(self.seats))
+    occupied[first:last] = nxt
+    return (occupied, changed)
 
   def count_occupied_neighbors(self, row_idx, seat_idx):
-    count = 0
-    for i in range(max(0, row_idx - 1), row_idx + 2):
-      for j in range(max(0, seat_idx - 1), seat_idx + 2):
-        try:
-          if i == row_idx and j == seat_idx: continue
-          if self.state[i][j] == SeatSimulation.OCCUPIED:
-            count += 1
-        except IndexError:
-          pass
-    return count
+    cell = self.index(row_idx, seat_idx)
+    return sum([self.occupied[cell + offset] for offset in self.neighbor_offsets])
 
   def calc_next_state(self):
-    new_state = self.copy_state(self.state)
-    for i in range(len(self.state)):
-      row = self.state[i]
-      for j in range(len(row)):
-        seat = row[j]
-        if seat == SeatSimulation.FLOOR: continue
-        if seat == SeatSimulation.SEAT:
-          if self.count_occupied_neighbors(i, j) == 0:
-            new_state[i][j] = SeatSimulation.OCCUPIED
-        if seat == SeatSimulation.OCCUPIED:
-          if self.count_occupied_neighbors(i, j) >= self.neighbor_tolerance:
-            new_state[i][j] = SeatSimulation.SEAT
-    return new_state
+    return self.rows_from(self.next_occupied()[0])
 
 class LineOfSightSeatSimulation(SeatSimulation):
+  """
+  Seat simulation where the neighbors of a seat are the first seats visible
+  in each of the eight directions. The floor never changes, so the visible
+  seats are found once, and each generation only re-examines the seats next
+  to a seat that changed in the previous one.
+  """
   def __init__(self, filename):
-    super().__init__(filename)
-    self.neighbor_tolerance = 5
+    super().__init__(filename, neighbor_tolerance=5)
+    self.build_visibility()
+
+  def build_visibility(self):
+    """
+    Store the visible seats of every cell in CSR form: the seats visible from
+    cell are visible[visible_start[cell]:visible_start[cell + 1]]. For each
+    direction, the nearest seat from a cell is either the next cell or the
+    next cell's nearest seat, so one sweep per direction finds them all.
+    """
+    size = len(self.seats)
+    interior = bytearray(size)
+    for i in range(self.height):
+      interior[self.index(i, 0):self.index(i, 0) + self.width] = b'\x01' * self.width
+
+    nearest_by_direction = []
+    for offset in self.neighbor_offsets:
+      nearest = array('l', [-1]) * size
+      # sweep against the direction so the next cell is always done first
+      cells = range(self.last - 1, self.first - 1, -1) if offset > 0 else range(self.first, self.last)
+      for cell in cells:
+        if not interior[cell]:
+          continue
+        neighbor = cell + offset
+        if self.seats[neighbor]:
+          nearest[cell] = neighbor
+        elif interior[neighbor]:
+          nearest[cell] = nearest[neighbor]
+      nearest_by_direction.append(nearest)
+
+    self.visible_start = array('L', [0])
+    self.visible = array('L')
+    for cell in range(size):
+      if self.seats[cell]:
+        self.visible.extend([nearest[cell] for nearest in nearest_by_direction if nearest[cell] >= 0])
+      self.visible_start.append(len(self.visible))
+    self._counted = None
+
+  def visible_from(self, cell):
+    return self.visible[self.visible_start[cell]:self.visible_start[cell + 1]]
 
   def trace_los(self, start_row, start_seat, row_delta, seat_delta):
     row = start_row + row_delta
     seat = start_seat + seat_delta
-    while row >= 0 and seat >= 0 and row < len(self.state) and seat < len(self.state[row]):
-      if self.state[row][seat] == SeatSimulation.OCCUPIED:
-        return True
-      elif self.state[row][seat] == SeatSimulation.SEAT:
-        return False
+    while row >= 0 and seat >= 0 and row < self.height and seat < self.width:
+      cell = self.index(row, seat)
+      if self.seats[cell]:
+        return self.occupied[cell] == 1
       row += row_delta
       seat += seat_delta
     return False
 
   def count_occupied_neighbors(self, row_idx, seat_idx):
-    count = 0
-    for row_delta in range(-1, 2):
-      for seat_delta in range(-1, 2):
-        if row_delta == 0 and seat_delta == 0: continue
-        if self.trace_los(row_idx, seat_idx, row_delta, seat_delta):
-          count += 1
+    occupied = self.occupied
+    return sum([occupied[cell] for cell in self.visible_from(self.index(row_idx, seat_idx))])
+
+  def neighbor_counts(self, occupied, first=None, last=None):
+    """
+    Count the occupied visible seats of every cell from first to last (by
+    default self.first to self.last), using the precomputed visibility
+    lists. These cross band boundaries freely, so a band needs nothing
+    beyond the shared occupancy to count its seats' neighbors.
+    """
+    if first is None:
+      (first, last) = (self.first, self.last)
+    counts = bytearray(last - first)
+    (visible, visible_start) = (self.visible, self.visible_start)
+    for cell in range(first, last):
+      if self.seats[cell]:
+        counts[cell - first] = sum([occupied[seat] for seat in visible[visible_start[cell]:visible_start[cell + 1]]])
+    return counts
+
+  def band_stepper(self, first, last):
+    """
+    Band version of step: the returned function keeps occupied neighbor
+    counts for the band's seats and only re-examines its active seats. A
+    seat outside the band that a band seat can see is watched; its value is
+    compared with the previous generation's at the start of every step, and
+    when it changed, the counts of the band seats that see it are updated
+    and those seats become active.
+    """
+    (visible, visible_start) = (self.visible, self.visible_start)
+    band_seats = [cell for cell in range(first, last) if self.seats[cell]]
+    # band seat -> the band seats it can see (and that can see it)
+    inside = {}
+    # outside seat -> the band seats that can see it
+    watchers = {}
+    for cell in band_seats:
+      inside[cell] = []
+      for seat in visible[visible_start[cell]:visible_start[cell + 1]]:
+        if first <= seat < last:
+          inside[cell].append(seat)
+        else:
+          watchers.setdefault(seat, []).append(cell)
+    watched = list(watchers)
+    tolerance = self.neighbor_tolerance
+    counts = None
+    active = band_seats
+    seen = None
+
+    def step(src, dst):
+      nonlocal counts, active, seen
+      current = bytes([src[seat] for seat in watched])
+      if counts is None:
+        counts = bytearray(len(self.seats))
+        for cell in band_seats:
+          counts[cell] = sum([src[seat] for seat in visible[visible_start[cell]:visible_start[cell + 1]]])
+      elif current != seen:
+        active = set(active)
+        for (seat, before, after) in zip(watched, seen, current):
+          if before != after:
+            for cell in watchers[seat]:
+              counts[cell] += after - before
+              active.add(cell)
+      seen = current
+
+      flips = [
+        cell for cell in active
+        if (counts[cell] >= tolerance if src[cell] else counts[cell] == 0)
+      ]
+      dst[first:last] = src[first:last]
+      active = set(flips)
+      for cell in flips:
+        delta = -1 if src[cell] else 1
+        dst[cell] ^= 1
+        for seat in inside[cell]:
+          counts[seat] += delta
+          active.add(seat)
+      return len(flips)
+    return step
+
+  def step(self):
+    """
+    Advance one generation by re-examining only the active seats: those that
+    changed last generation and the seats that can see them. Occupied
+    neighbor counts are kept up to date as seats change.
+    """
+    (visible, visible_start) = (self.visible, self.visible_start)
+    occupied = self.occupied
+    if self._counted is not occupied:
+      # first step, or the occupancy was replaced from outside
+      counts = bytearray(len(self.seats))
+      counts[self.first:self.last] = self.neighbor_counts(occupied)
+      self.counts = counts
+      self.active = [cell for cell in range(self.first, self.last) if self.seats[cell]]
+      self._counted = occupied
+    counts = self.counts
+    tolerance = self.neighbor_tolerance
+
+    flips = [
+      cell for cell in self.active
+      if (counts[cell] >= tolerance if occupied[cell] else counts[cell] == 0)
+    ]
+    active = set(flips)
+    for cell in flips:
+      delta = -1 if occupied[cell] else 1
+      occupied[cell] ^= 1
+      for seat in visible[visible_start[cell]:visible_start[cell + 1]]:
+        counts[seat] += delta
+        active.add(seat)
+    self.active = active
+    return len(flips)
 
-    return count
+def step_band(simulation, buffer_names, band, k, jobs, changed, barrier):
+  """
+  Worker process for SeatSimulation.run_banded: step band k of the grid
+  every generation until no band changes.
+  """
+  (first, last) = band
+  step = simulation.band_stepper(first, last)
+  buffers = [SharedMemory(name=name) for name in buffer_names]
+  try:
+    generation = 0
+    while True:
+      parity = generation % 2
+      src = buffers[parity].buf
+      dst = buffers[1 - parity].buf
+      changed[parity * jobs + k] = step(src, dst)
+      barrier.wait()
+      # every worker has read this parity's counts before any worker can
+      # write it again, two generations from now
+      if sum(changed[parity * jobs:(parity + 1) * jobs]) == 0:
+        break
+      generation += 1
+  except BaseException:
+    # let the other workers out of the barrier instead of leaving them waiting
+    barrier.abort()
+    raise
+  finally:
+    src = dst = None
+    for shm in buffers:
+      try:
+        shm.close()
+      except BufferError:
+        # a step that failed part way may still hold views of the buffer
+        pass
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument('filename', help='Path to the file with the ferry seat layout')
+  parser.add_argument('--jobs', '-j', type=int, default=1, help='Step horizontal bands of the grid in this many parallel processes')
   args = parser.parse_args()
 
   print('Simulation 1: tolerate up to 4 immediate neighbors')
   simulation_1 = SeatSimulation(args.filename)
-  simulation_1.run_til_settled()
+  simulation_1.run_til_settled(args.jobs)
   print('Occupied seats:', simulation_1.count_occupied())
 
   print('Simulation 2: tolerate up to 5 neighbors within line of sight')
   simulation_2 = LineOfSightSeatSimulation(args.filename)
-  simulation_2.run_til_settled()
-  print('Occupied seats:', simulation_2.count_occupied())
\ No newline at end of file
+  simulation_2.run_til_settled(args.jobs)
+  print('Occupied seats:', simulation_2.count_occupied())